@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv
+import filecmp
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, fields
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from stp.emulator import Emulator, Link, Loss
+from stp.cli import parse_opts
+
+@dataclass
+class Control:
+    """Control block: parameters for the benchmark program."""
+    txt_file_to_send: str
+    window: str = '30000'   # --window, --rto, --min-rto, --mss, --loss: comma separated values, every combination is run
+    rto: str = '100'        # --rto: the sender's initial RTO, ms, only used until the first RTT sample
+    min_rto: str = '200'    # --min-rto: floor of the adaptive RTO, ms, the one in effect on a short path
+    mss: str = '1000'
+    loss: str = '0'         # uniform (0.02) or Gilbert-Elliott (ge:P_GB:P_BG[:LOSS_BAD[:LOSS_GOOD]]), both ways
+    compress: str = 'off'   # --compress: swept as well, off, zlib or lzma
+    pace: str = '0'         # --pace: swept as well, 0 or 1
+    delay: float = 0;   jitter: float = 0   # --delay / --jitter: ms each way
+    reorder: float = 0      # --reorder: share of datagrams held back 10 ms
+    rate: float = 0         # --rate: bottleneck bytes/s each way, 0 = unlimited
+    cc: str = 'reno'
+    repeat: int = 1;    seed: int = 1       # --repeat: runs per combination, run i uses seed+i
+    format: str = 'jsonl'   # --format: jsonl or csv
+    out: str = ''           # --out: result file, default stdout
+    port: int = 50200       # --port: first of the 4 consecutive ports a run uses
+    timeout: int = 300      # --timeout: seconds before a run is killed
+#--------------------------------------------------------------------------#
+#---------------------------------Main body--------------------------------#
+#--------------------------------------------------------------------------#
+def main():
+    if len(sys.argv) < NUM_ARGS + 1:
+        sys.exit(f"Usage: {sys.argv[0]} txt_file_to_send [--option=value ...]")
+    global control
+    control = parse_argv(sys.argv)
+    out = open(control.out, 'w', newline='') if control.out else sys.stdout
+    writer = None
+
+    cases = itertools.product(split(control.window, int), split(control.rto, int), split(control.min_rto, int), split(control.mss, int),
+                              split(control.loss, str), split(control.compress, str), split(control.pace, int), range(control.repeat))
+    for window, rto, min_rto, mss, loss, compress, pace, repeat in cases:
+        result = run_case(window, rto, min_rto, mss, loss, compress, pace, control.seed + repeat)
+        if control.format == 'csv':
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=list(result));  writer.writeheader()
+            writer.writerow(result)
+        else:
+            out.write(json.dumps(result) + '\n')
+        out.flush()
+    if control.out: out.close()
+#--------------------------------------------------------------------------#
+#------------------------Self defined functions----------------------------#
+#--------------------------------------------------------------------------#
+def run_case(window: int, rto: int, min_rto: int, mss: int, loss: str, compress: str, pace: int, seed: int) -> dict: #One transfer through the emulator
+    sender_port, proxy_port, source_port, receiver_port = range(control.port, control.port + 4)
+    size = os.path.getsize(control.txt_file_to_send)
+    workdir = tempfile.mkdtemp(prefix='stp-bench-')
+    impairment = dict(delay=control.delay / 1000, jitter=control.jitter / 1000, reorder=control.reorder, rate=control.rate)
+    forward = Link(loss, seed=f"{seed}/forward", **impairment)
+    backward = Link(loss, seed=f"{seed}/backward", **impairment)
+    emulator = Emulator(proxy_port, ('127.0.0.1', receiver_port), forward, backward, source_port)
+    emulator.start()
+    try:
+        receiver = subprocess.Popen([sys.executable, RECEIVER, str(receiver_port), str(source_port), 'received',
+                                     str(window), '--log=summary'], cwd=workdir)
+        time.sleep(RECEIVER_START)
+        start = time.monotonic()
+        sender = subprocess.Popen([sys.executable, SENDER, str(sender_port), str(proxy_port),
+                                   os.path.abspath(control.txt_file_to_send), str(window), str(rto), '0', '0',
+                                   f'--min-rto={min_rto}', f'--mss={mss}', f'--cc={control.cc}', f'--compress={compress}', f'--pace={pace}', '--log=summary', '--stats-file=stats.json',
+                                   f'--stats-interval={control.timeout * 1000}'], cwd=workdir)
+        sender_status, sender_cpu = wait(sender, control.timeout)
+        seconds = time.monotonic() - start
+        receiver_status, receiver_cpu = wait(receiver, control.timeout)
+        emulator.stop()
+
+        ok = sender_status == 0 and receiver_status == 0 and \
+             filecmp.cmp(control.txt_file_to_send, os.path.join(workdir, 'received'), shallow=False)
+        stats = read_stats(os.path.join(workdir, 'stats.json'))
+    finally:
+        if emulator.is_alive(): emulator.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    gauges = stats.get('gauges', {});   stats = stats.get('counters', {})
+    final_rto = gauges.get('rto')
+    return {'window': window, 'initial_rto': rto, 'min_rto': min_rto,
+            'rto': round(final_rto * 1000, 1) if final_rto is not None else None,    # the adaptive RTO at the end of the run, ms
+            'srtt': round(gauges['srtt'] * 1000, 3) if gauges.get('srtt') is not None else None, 'mss': mss, 'loss': loss, 'compress': compress, 'pace': pace, 'delay': control.delay, 'jitter': control.jitter,
+            'reorder': control.reorder, 'rate': control.rate, 'cc': control.cc, 'seed': seed, 'ok': ok,
+            'bytes': size, 'seconds': round(seconds, 4), 'goodput': round(size / seconds) if ok else 0,
+            'cpu_sender': round(sender_cpu, 4), 'cpu_receiver': round(receiver_cpu, 4),
+            'cpu_per_mb': round((sender_cpu + receiver_cpu) / (size / 1e6), 4) if size else None,
+            'retransmitted': stats.get('retransmitted'), 'timeouts': stats.get('timeouts'),
+            'fast_retransmits': stats.get('fast_retransmits'), 'data_sent': stats.get('data_sent'),
+            'lost_forward': forward.lost + forward.overflow, 'lost_backward': backward.lost + backward.overflow}
+
+def wait(proc, timeout: float) -> tuple: #Exit code and CPU seconds (user + system) of a child, killed after `timeout`
+    result = {}
+    def reap():
+        _, status, usage = os.wait4(proc.pid, 0)
+        result['code'] = os.waitstatus_to_exitcode(status);  result['cpu'] = usage.ru_utime + usage.ru_stime
+    reaper = threading.Thread(target=reap);     reaper.start();     reaper.join(timeout)
+    if reaper.is_alive():
+        proc.kill();    reaper.join()
+    proc.returncode = result['code']    # already reaped, keep Popen from waiting again
+    return result['code'], result['cpu']
+
+def read_stats(path: str) -> dict: #The sender's final metrics snapshot
+    try:
+        with open(path) as file: return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def split(values: str, type) -> list:
+    return [type(value) for value in values.split(',')]
+
+def parse_argv(argv) -> Control:
+    try:
+        control = Control(argv[1])
+        parse_opts(control, argv[NUM_ARGS + 1:], OPTIONS)
+        for spec in split(control.loss, str): Loss(spec, random.Random())
+        split(control.window, int); split(control.rto, int);  split(control.min_rto, int);   split(control.mss, int);  split(control.pace, int)
+    except ValueError as e:
+        sys.exit(f"Invalid argument! {e}")
+    if not os.path.isfile(control.txt_file_to_send):
+        sys.exit(f"Invalid file argument, {control.txt_file_to_send} does not exist")
+    if control.format not in ('jsonl', 'csv'):
+        sys.exit(f"Invalid format option, must be jsonl or csv")
+    if not hasattr(os, 'wait4'):
+        sys.exit(f"The benchmark needs os.wait4 to measure CPU time")
+    return control
+
+#--------------------------------------------------------------------------#
+#------------------------Entrance of the code------------------------------#
+#--------------------------------------------------------------------------#
+if __name__ == "__main__":
+    NUM_ARGS = 1  # Number of command-line arguments
+    SENDER = os.path.join(ROOT, 'sender', 'sender.py')
+    RECEIVER = os.path.join(ROOT, 'receiver', 'receiver.py')
+    OPTIONS = [f.name for f in fields(Control)][1:]    # Control fields settable with --name=value: all but the file
+    RECEIVER_START = 0.3    # Seconds the receiver gets to bind before the sender starts
+    control: Control
+    main()
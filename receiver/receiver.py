@@ -1,134 +1,604 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-
-import socket
-import sys
-import time
-import threading
-from dataclasses import dataclass
-
-@dataclass
-class Control:
-    """Control block: parameters for the sender program."""
-    receiver_port: int
-    sender_port: int
-    txt_file_received: str
-    max_win: int         
-    is_alive: bool = True
-    ori_data_recv: int = 0; ori_seg_recv: int = 0
-    dup_seg_recv: int = 0; dup_seg_snd: int = 0
-#--------------------------------------------------------------------------#
-#---------------------------------Main body--------------------------------#
-#--------------------------------------------------------------------------#
-def main():
-    if len(sys.argv) != NUM_ARGS + 1:
-        sys.exit(f"Usage: {sys.argv[0]} port wait_time")
-    global startTime, window, remainWin, control
-    control = parse_argv(sys.argv)
-    next_seq = 0
-
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
-        #-------------------Listening state------------------------#
-        receiver.bind(('', control.receiver_port)); receiver.settimeout(None)
-        while control.is_alive:
-            buf, addr = receiver.recvfrom(1024)
-
-            rcv_type, rcv_seqno, rcv_data= parse_packet(buf)
-
-            if rcv_type == 2 and addr[1] == control.sender_port:
-                startTime = time.time()
-                record_log('rcv', 'SYN', rcv_seqno, 0)
-                next_seq = reply_ACK(receiver, rcv_seqno, 1, addr)
-                break
-            else:
-                print("Detect unexpected behaviour, here to terminate!")
-                sys.exit(0)
-        #-----------------Established state------------------------#
-        remainWin = control.max_win
-
-            if addr[1] == control.sender_port:
-                rcv_type, rcv_seqno, rcv_data = parse_packet(buf)
-                if rcv_type == 0 and remainWin >= len(rcv_data):
-                    if  (rcv_seqno - next_seq + 65536)%65536 <= control.max_win:
-                        record_log('rcv', 'DATA', rcv_seqno, len(rcv_data))
-                        window[rcv_seqno] = rcv_data;   remainWin -= len(rcv_data)
-
-                        while next_seq in window:
-                            data = window.pop(next_seq);    remainWin+=len(data)
-                            control.ori_data_recv += len(data); control.ori_seg_recv += 1
-                            file.write(data.decode("utf-8"))
-                            next_seq =  (next_seq + len(data))%65536
-                            
-                    record_log('rcv', 'FIN', rcv_seqno, 0)
-                    reply_ACK(receiver, rcv_seqno, 1, addr)
-                    break               
-        #-----------------------Time Wait--------------------------#
-        timer = threading.Timer(2*MSL, timer_thread)
-        timer.start();  receiver.settimeout(MSL)
-        while control.is_alive:
-            try:
-                buf, addr = receiver.recvfrom(1024)
-                rcv_type, rcv_seqno, rcv_data = parse_packet(buf)
-                if rcv_type == 3 and addr[1] == control.sender_port:
-                    record_log('rcv', 'FIN', rcv_seqno, 0)
-                    reply_ACK(receiver, rcv_seqno, 1, addr)
-                else:
-                    print("Detect unexpected behaviour, here to terminate!")
-                    sys.exit(0)
-            except socket.timeout:
-                continue
-
-
-    log.write(f"\nOriginal data received:\t\t{control.ori_data_recv}\n")
-    log.write(f"Original segments received:\t{control.ori_seg_recv}\n")
-    log.write(f"Dup data segments received:\t{control.dup_seg_recv}\n")
-    log.write(f"Dup ack segments sent:\t\t{control.dup_seg_snd}\n")
-    file.close();   log.close()
-    sys.exit(0)
-#--------------------------------------------------------------------------#
-#------------------------Self defined functions----------------------------#
-#--------------------------------------------------------------------------#
-def timer_thread():
-    pkt = (1).to_bytes(2, byteorder='big');     
-    seqno = (rcv_seqno + size) % 65536
-    pkt += seqno.to_bytes(2, byteorder='big')
-    while True:
-        if (socket.sendto(pkt, addr) == len(pkt)): break
-    record_log('snd', 'ACK', seqno, 0)
-    return seqno
-
-def parse_packet(buf):
-    type = int.from_bytes(buf[:2], byteorder='big')
-    seqno = int.from_bytes(buf[2:4], byteorder='big')
-    data = buf[4:]
-    return type, seqno, data
-
-def parse_argv(argv):
-    min_port = 49152;   max_port = 65535
-    min_win = 1000
-    try:
-        receiver_port = int(argv[1])
-        sender_port = int(argv[2])
-        txt_file_received = argv[3]
-        max_win = int(argv[4])
-        control = Control(receiver_port, sender_port, txt_file_received, max_win)
-    except ValueError:
-        sys.exit(f"Invalid argument!")
-    
-    if not (min_port <= sender_port <= max_port or min_port <= receiver_port <= max_port):
-        sys.exit(f"Invalid port argument, must be between {min_port} and {max_port}")
-    if max_win < min_win:
-        sys.exit(f"Invalid window argument, must larger or equal than {min_win}")
-
-    return control
-
-#--------------------------------------------------------------------------#
-#------------------------Entrance of the code------------------------------#
-#--------------------------------------------------------------------------#
-if __name__ == "__main__":
-    NUM_ARGS = 4  # Number of command-line arguments
-    MSL = 1       # Maximum segment lifetimes, second
-    t = {0: 'DATA', 1:'ACK', 2:'SYN', 3:'FIN'}
-    window = {};    remainWin = 0;  startTime = 0
-    control: Control
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import heapq
+import itertools
+import os
+import select
+import selectors
+import socket
+import sys
+import threading
+import time
+try:
+    import fcntl
+except ImportError:     # Windows: stripes of one file must then be served by a single process
+    fcntl = None
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stp.packet import (DATA, ACK, SYN, FIN, MAX_HDR, MAX_MSS, DEFAULT_MSS, DIGEST_SIZE, OPT_MSS, OPT_SEQ32, OPT_WINDOW,
+                        OPT_STRIPE, OPT_COMPRESS, OPT_RESUME, OPT_CHECKSUM, OPT_FILES, OPT_RWND, make_header, parse_packet, intact, pack_options, unpack_options, Stripe, unpack_stripe)
+from stp.seqnum import SEQ16, SEQ32
+from stp.log import LEVELS, PacketLog
+from stp.metrics import Registry, Reporter
+from stp.receive import ReceiveWindow
+from stp.compress import RAW, Inflater, accept
+from stp.resume import Checkpoint
+from stp.multifile import Demuxer
+from stp.cli import parse_opts, set_buffers, recv_batch
+
+@dataclass
+class Control:
+    """Control block: parameters for the receiver program."""
+    receiver_port: int
+    sender_port: int
+    txt_file_received: str
+    max_win: int         
+    rcvbuf: int = 0;    sndbuf: int = 0     # --rcvbuf/--sndbuf: socket buffer bytes, 0 = OS default
+    ack_every: int = 1      # --ack-every: in-order segments covered by one ACK
+    ack_delay: int = 0      # --ack-delay: ms an in-order segment may wait for its ACK
+    mss: int = MAX_MSS      # --mss: largest payload accepted, the SYN may only lower it
+    server: int = 0         # --server: 1 = serve any number of senders, output is a directory
+    log: str = 'packet'     # --log: off, summary or packet (every segment)
+    log_format: str = 'text'    # --log-format: text or binary (decode with python -m stp.log)
+    stats_port: int = 0     # --stats-port: serve JSON snapshots of the metrics on 127.0.0.1:PORT
+    stats_file: str = ''    # --stats-file: rewrite this JSON snapshot every --stats-interval ms
+    stats_interval: int = 1000
+    time_wait: str = '2000' # --time-wait: ms a finished connection answers FIN retransmissions, or auto (see time_wait())
+    write_queue: int = 8 * 1024 * 1024  # --write-queue: bytes a thread may have left to write, advertised as window; 0 = write inline
+    workers: int = 1        # --workers: processes sharing the port through SO_REUSEPORT (server mode)
+    idle_timeout: int = 60000   # --idle-timeout: ms without a segment before a server-mode connection is given up; 0 = never
+#--------------------------------------------------------------------------#
+#---------------------------------Main body--------------------------------#
+#--------------------------------------------------------------------------#
+def main():
+    if len(sys.argv) < NUM_ARGS + 1:
+        sys.exit(f"Usage: {sys.argv[0]} receiver_port sender_port txt_file_received max_win [--option=value ...]")
+    global control, manifest
+    control = parse_argv(sys.argv)
+    if control.server:
+        os.makedirs(control.txt_file_received, exist_ok=True)
+        manifest = os.open(os.path.join(control.txt_file_received, 'manifest.txt'), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    if control.workers == 1:
+        serve(0);   sys.exit(0)
+
+    # Every worker binds its own socket to the same port, the kernel hashes
+    # each sender's address to one of them, so a connection never moves.
+    workers = []
+    for worker in range(control.workers):
+        pid = os.fork()
+        if pid == 0:
+            serve(worker);  os._exit(0)
+        workers.append(pid)
+    for pid in workers: os.waitpid(pid, 0)
+    sys.exit(0)
+
+def serve(worker: int): #Event loop of one receiver process
+    global selector, writer
+    writer = WriteBehind(control.write_queue) if control.write_queue else None
+    if writer: writer.start()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        if control.workers > 1: receiver.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        receiver.bind(('', control.receiver_port)); receiver.setblocking(False)
+        set_buffers(receiver, control.rcvbuf, control.sndbuf)
+        if not control.rcvbuf and receiver.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) < 2 * control.max_win:
+            set_buffers(receiver, 2 * control.max_win, 0)  # room for a full window of large datagrams
+        selector = selectors.DefaultSelector();  selector.register(receiver, selectors.EVENT_READ)
+        conns = {};     timers = []     # peer address -> Connection, heap of (deadline, n, Connection)
+        closed = collections.OrderedDict()  # peer address -> (seq space, checked) of connections past TIME_WAIT
+        served = 0;     ticket = itertools.count()
+        reporter = setup_metrics(conns, worker)
+
+        # Without --server a single sender (on sender_port, stripe i on
+        # sender_port+i) is served and the program ends once all its
+        # connections left TIME_WAIT.
+        while control.server or not served or conns or unfinished:
+            timeout = max(0, timers[0][0] - time.monotonic()) if timers else None
+            batch = recv_batch(selector, receiver.recvfrom, MAX_HDR + control.mss, timeout);   heard = time.monotonic()
+            for buf, addr in batch:
+                conn = conns.get(addr)
+                if int.from_bytes(buf[:2], 'big') == SYN and (conn is None or conn.syn != buf):
+                    if not control.server and addr[1] != control.sender_port + syn_stripe(buf).index: continue
+                    if conn: conn.close()   # the sender restarted, drop the old incarnation
+                    served += 1
+                    conn = conns[addr] = Connection(receiver, addr, buf, *connection_files(addr, worker, served))
+                elif conn is None:
+                    if addr in closed: answer_late_fin(receiver, buf, addr, *closed[addr])
+                    continue    # stray segment of a connection that is gone
+                else:
+                    conn.on_packet(buf)
+                conn.heard = heard
+                if conn.armed:  # conn set new delayed ACK / window / TIME_WAIT / idle deadlines
+                    for deadline in conn.armed: heapq.heappush(timers, (deadline, next(ticket), conn))
+                    conn.armed.clear()
+            now = time.monotonic()
+            while timers and timers[0][0] <= now:
+                conn = heapq.heappop(timers)[2]
+                if conns.get(conn.addr) is conn and conn.on_timer(now):
+                    del conns[conn.addr]
+                    if control.server and conn.closing_at is not None:  # a short TIME_WAIT may end before a lost FIN ACK is noticed
+                        closed[conn.addr] = (conn.seq, conn.checked);   closed.move_to_end(conn.addr)
+                        if len(closed) > CLOSED_MAX: closed.popitem(last=False)
+                if conn.armed:
+                    for deadline in conn.armed: heapq.heappush(timers, (deadline, next(ticket), conn))
+                    conn.armed.clear()
+        if writer: writer.wait()
+        if reporter: reporter.stop()
+#--------------------------------------------------------------------------#
+#------------------------Self defined functions----------------------------#
+#--------------------------------------------------------------------------#
+class Connection:
+    """One transfer from one sender: its reorder window, output file, log and timers.
+
+    Built from the SYN, which is kept to tell a retransmitted SYN (answered
+    with the same SYN ACK) from a new incarnation on the same address.
+    `armed` collects the new deadlines to be put on the main loop's timer
+    heap; on_timer() ignores deadlines that went stale. In server mode an
+    idle deadline gives up on a sender that stopped sending without a FIN.
+    """
+    def __init__(self, sock, addr, syn: bytes, filename: str, logname: str):
+        self.sock = sock;   self.addr = addr;   self.syn = syn
+        rcv_type, rcv_seqno, rcv_data = parse_packet(syn)
+        options = unpack_options(rcv_data)  # a sender without options uses DEFAULT_MSS
+        self.stripe = unpack_stripe(options.get(OPT_STRIPE, b''))
+        resume = options.get(OPT_RESUME);   self.checkpoint = None;     self.demux = None
+        if self.stripe:     # all stripes of a transfer write into one file, each at its own offset
+            filename, logname = stripe_files(addr, self.stripe, filename, logname)
+            unfinished.setdefault(self.stripe.session, set(range(self.stripe.count)))
+            self.file = OutputFile(filename, self.stripe.offset, truncate=False)
+        elif resume is not None and len(resume) == 16:  # keep what an earlier attempt at this file wrote
+            filename = resume_file(addr, resume, filename)
+            self.checkpoint = Checkpoint(filename, resume)
+            self.file = OutputFile(filename, self.checkpoint.offset, truncate=False)
+            os.ftruncate(self.file.fd, self.checkpoint.offset);     self.file.checkpoint = self.checkpoint
+        elif OPT_FILES in options:  # multi-file session: the output is a directory of the files it carries
+            os.makedirs(filename, exist_ok=True);   self.file = None
+            self.demux = Demuxer(lambda name: OutputFile(os.path.join(filename, name)),
+                                 lambda name, size: self.received.append((os.path.join(filename, name), size)))
+        else:
+            self.file = OutputFile(filename)
+        self.received = []      # (path, size) of the complete files
+        self.write = self.demux_stream if self.demux else self.file.append  # where in-order file data goes
+        self.filename = filename
+        self.log = PacketLog(logname, LEVELS[control.log], control.log_format == 'binary')
+        self.seq = SEQ16    # sequence space, SEQ32 once negotiated
+        self.checked = False    # headers carry a CRC32, once negotiated
+        self.digest = None;     self.rtt = None     # digest of the file data when checked, handshake RTT
+        self.unacked = 0;   self.ack_due = None # in-order segments not acked yet, deadline of their ACK
+        self.advertised = None;     self.update_due = None  # window of the last ACK, next check for a window update
+        self.closing_at = None;     self.armed = []
+        self.waiting = 0    # length of the current TIME_WAIT, seconds
+        self.heard = time.monotonic()   # last segment from the sender, set by the main loop
+        idle = control.idle_timeout / 1000 if control.server else 0
+        self.idle_due = self.arm(self.heard + idle) if idle else None
+        self.ori_data_recv = 0; self.ori_seg_recv = 0
+        self.dup_seg_recv = 0;  self.dup_seg_snd = 0;   self.corrupt_seg_recv = 0
+        self.max_depth = 0;     totals['connections'] += 1  # most segments ever held out of order
+
+        #-------------------Listening state------------------------#
+        self.record_log('rcv', 'SYN', rcv_seqno, 0)
+        peer_mss = int.from_bytes(options.get(OPT_MSS, DEFAULT_MSS.to_bytes(2, 'big')), 'big')
+        accepted = {OPT_SEQ32: b''} if OPT_SEQ32 in options else {}
+        self.max_win = min(control.max_win, (SEQ32 if accepted else SEQ16).half - 1)
+        if self.stripe: accepted[OPT_STRIPE] = b''
+        if self.checkpoint: accepted[OPT_RESUME] = self.checkpoint.offset.to_bytes(8, 'big')
+        if OPT_CHECKSUM in options: accepted[OPT_CHECKSUM] = b''
+        if self.demux: accepted[OPT_FILES] = b''
+        if OPT_RWND in options and writer: accepted[OPT_RWND] = b''
+        method = accept(options.get(OPT_COMPRESS, b''))
+        if method != RAW: accepted[OPT_COMPRESS] = bytes([method])
+        self.inflater = Inflater() if method != RAW else None   # undoes the sender's compression
+        self.mss = min(control.mss, self.max_win, peer_mss)
+        self.syn_ack = pack_options({OPT_MSS: self.mss.to_bytes(2, 'big'),
+                                     OPT_WINDOW: self.max_win.to_bytes(4, 'big'), **accepted})
+        next_seq = self.reply_ACK(rcv_seqno, 1, self.syn_ack);    self.syn_acked_at = time.monotonic()
+        if OPT_SEQ32 in accepted:   # from here on every header carries 32-bit seqnos
+            self.seq = SEQ32;   next_seq = SEQ32.add(SEQ32.unpack(options[OPT_SEQ32]), 1)
+        self.checked = OPT_CHECKSUM in accepted     # ... and a CRC32, the FIN a digest of the file data
+        self.rwnd = OPT_RWND in accepted    # ... and data ACKs the free window of the write queue
+        if self.checked:
+            self.digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+            if self.file: self.file.digest = self.digest    # fed as it is written; a session's stream in demux_stream()
+        self.rcv = ReceiveWindow(self.seq, next_seq, self.max_win, self.deliver)  # in-order point and reorder ring
+
+    def on_packet(self, buf):
+        if int.from_bytes(buf[:2], 'big') == SYN:  # our SYN ACK was lost, answer the same way again
+            self.reply_ACK(SEQ16.unpack(buf, 2), 1, self.syn_ack, SEQ16)
+            self.syn_acked_at = time.monotonic();   return
+        if self.rtt is None: self.rtt = time.monotonic() - self.syn_acked_at   # the sender's first segment answers the SYN ACK
+        if self.checked and not intact(buf, self.seq):  # corrupted on the way, the sender resends it
+            self.corrupt_seg_recv += 1; return
+        rcv_type, rcv_seqno, rcv_data = parse_packet(buf, self.seq, self.checked)
+        #-----------------------Time Wait--------------------------#
+        if self.closing_at is not None:
+            if rcv_type == FIN:     # the FIN ACK was lost: restart TIME_WAIT, twice as long as the sender's RTO doubles too
+                self.record_log('rcv', 'FIN', rcv_seqno, 0)
+                self.reply_ACK(rcv_seqno, 1)
+                self.waiting *= 2;  self.closing_at = self.arm(time.monotonic() + self.waiting)
+            return
+        #-----------------Established state------------------------#
+        reorder = self.rcv.reorder
+        if rcv_type == DATA and not rcv_data:   # zero window probe: answer with the current window
+            self.send_ack()
+        elif rcv_type == DATA:
+            holes = bool(reorder)
+            new = self.rcv.on_data(rcv_seqno, rcv_data)
+            if new > 0:
+                self.record_log('rcv', 'DATA', rcv_seqno, len(rcv_data))
+                self.ori_data_recv += new;  self.ori_seg_recv += 1
+                if reorder.segments > self.max_depth: self.max_depth = reorder.segments
+            else:   # duplicate, or beyond the window (not counted, the sender resends it)
+                if new == 0: self.dup_seg_recv += 1
+                self.dup_seg_snd += 1
+            if new <= 0 or holes or reorder:    # duplicate, out of order or gap filling: ACK at once
+                self.unacked = control.ack_every
+            else:
+                self.unacked += 1
+                if self.ack_due is None:
+                    self.ack_due = self.arm(time.monotonic() + control.ack_delay / 1000)
+            if self.unacked >= control.ack_every: self.send_ack()
+        elif rcv_type == FIN:
+            self.record_log('rcv', 'FIN', rcv_seqno, 0)
+            self.reply_ACK(rcv_seqno, 1)
+            complete = self.close_output()  # all data is in, TIME_WAIT only answers FIN retransmissions
+            if self.checkpoint: self.checkpoint.remove()
+            verified = (not self.checked or self.verify(rcv_data)) and complete
+            if self.stripe: finish_stripe(self, verified)
+            elif manifest is not None and verified:
+                for path, size in self.received: record_manifest(self.addr, size, path)
+            self.waiting = self.time_wait();    self.closing_at = self.arm(time.monotonic() + self.waiting)
+
+    def close_output(self) -> bool: #Flush and close the output at the FIN; False if a session stopped inside a file
+        if self.demux is None:
+            self.file.close();  self.file.wait()    # on disk before the checkpoint goes and the digest is compared
+            self.received.append((self.filename, self.file.tell()))
+            return True
+        complete = self.demux.close()
+        if writer: writer.wait()    # ... and before the manifest lists the files
+        if complete: return True
+        self.log.summary(f"\nSession incomplete:\t\tthe stream ended inside {self.demux.name}\n")
+        print(f"{self.filename}: multi-file session incomplete, the stream ended inside {self.demux.name}", file=sys.stderr)
+        return False
+
+    def time_wait(self) -> float: #Seconds in TIME_WAIT: --time-wait, or with auto TW_RTOS of the sender's RTO
+        if control.time_wait != 'auto': return int(control.time_wait) / 1000
+        rto = max(TW_MIN_RTO, 3 * (self.rtt or 0))  # after one sample the sender's RTO is srtt + 4 * rtt/2, never below its floor
+        return TW_RTOS * rto
+
+    def verify(self, digest) -> bool: #Compare the FIN's digest with the one of the bytes written, report a mismatch
+        if self.digest.digest() == bytes(digest): return True
+        self.log.summary(f"\nFile digest mismatch:\t\tthe data written is corrupted\n")
+        print(f"{self.filename}: digest mismatch, the data written is corrupted", file=sys.stderr)
+        return False
+
+    def deliver(self, data): #In-order stream bytes into the output, decompressed if the sender compresses
+        if self.inflater is None: return self.write(data)
+        for chunk in self.inflater.feed(data): self.write(chunk)
+
+    def demux_stream(self, data): #A multi-file session's stream: digested as a whole, split into files
+        if self.digest: self.digest.update(data)
+        self.demux.feed(data)
+
+    def window(self) -> int: #Receive window: room in the write queue, less a flush that may still come, at most max_win
+        return max(0, min(self.max_win, writer.free() - WRITE_BUF))
+
+    def on_timer(self, now: float) -> bool:
+        """Send a due delayed ACK or window update; True once TIME_WAIT is over and the connection closed."""
+        if self.update_due is not None and now >= self.update_due and self.closing_at is None:
+            self.update_due = None
+            if self.window() >= min(self.advertised + self.mss, self.max_win): self.send_ack()  # reopened, tell the sender
+            else: self.update_due = self.arm(now + WINDOW_POLL)
+        if self.ack_due is not None and now >= self.ack_due and self.closing_at is None:
+            self.send_ack()
+        if self.idle_due is not None and now >= self.idle_due and self.closing_at is None:
+            idle = control.idle_timeout / 1000
+            if now - self.heard < idle:     # heard from since it was armed
+                self.idle_due = self.arm(self.heard + idle)
+            else:
+                self.abandon(now - self.heard);     return True
+        if self.closing_at is not None and now >= self.closing_at:
+            self.close();   return True
+        return False
+
+    def arm(self, deadline: float) -> float: #Queue a deadline for the main loop's timer heap
+        self.armed.append(deadline)
+        return deadline
+
+    def abandon(self, idle: float): #The sender went silent before its FIN: close the output unfinished and report it
+        self.log.summary(f"\nConnection idle:\t\tno segment for {idle:.1f}s, closed unfinished\n")
+        print(f"{self.filename}: no segment from {self.addr[0]}:{self.addr[1]} for {idle:.1f}s, closed unfinished", file=sys.stderr)
+        totals['idle_closed'] += 1
+        self.close()
+
+    def send_ack(self):
+        window = None
+        if self.rwnd:
+            window = self.advertised = self.window()
+            if window < self.max_win and self.update_due is None:   # watch the queue drain
+                self.update_due = self.arm(time.monotonic() + WINDOW_POLL)
+        self.reply_ACK(self.rcv.next_seq, 0, self.rcv.ack_payload(window))
+        self.unacked = 0;   self.ack_due = None
+
+    def close(self):
+        if self.log.file is None: return
+        self.log.summary(f"\nOriginal data received:\t\t{self.ori_data_recv}\n")
+        self.log.summary(f"Original segments received:\t{self.ori_seg_recv}\n")
+        self.log.summary(f"Dup data segments received:\t{self.dup_seg_recv}\n")
+        self.log.summary(f"Dup ack segments sent:\t\t{self.dup_seg_snd}\n")
+        if self.checked: self.log.summary(f"Corrupt segments dropped:\t{self.corrupt_seg_recv}\n")
+        if self.demux: self.log.summary(f"Files received:\t\t\t{self.demux.files}\n")
+        if self.closing_at is None:
+            if self.demux: self.demux.close()
+            else: self.file.close();    self.file.wait()
+            if self.checkpoint: self.checkpoint.close()     # unfinished, a later SYN may resume it
+        self.log.close()
+        for field in ('ori_data_recv', 'ori_seg_recv', 'dup_seg_recv', 'dup_seg_snd', 'corrupt_seg_recv'): totals[field] += getattr(self, field)
+        totals['max_depth'] = max(totals['max_depth'], self.max_depth)
+
+    def metrics(self) -> dict:
+        return {'peer': f"{self.addr[0]}:{self.addr[1]}", 'data_received': self.ori_data_recv,
+                'segments_received': self.ori_seg_recv, 'dup_segments_received': self.dup_seg_recv,
+                'reorder_depth': self.rcv.reorder.segments, 'max_reorder_depth': self.max_depth,
+                'state': 'TIME_WAIT' if self.closing_at else 'ESTABLISHED'}
+
+    def reply_ACK(self, rcv_seqno, size, payload=b'', space=None): #payload: SYN options, or window and SACK blocks
+        checked = self.checked and space is None    # the SYN ACK never carries a checksum
+        space = space or self.seq
+        seqno = space.add(rcv_seqno, size)
+        pkt = make_header(space, ACK, seqno, payload if checked else None) + payload
+        while True:
+            try:
+                if (self.sock.sendto(pkt, self.addr) == len(pkt)): break
+            except BlockingIOError:     # send buffer full, wait until it drains
+                select.select([], [self.sock], [])
+        self.record_log('snd', 'ACK', seqno, 0)
+        return seqno
+
+    def record_log(self, kind, type, seqno, length):
+        self.log.packet(kind, type, seqno, length)
+
+class OutputFile:
+    """Binary output file written by position.
+
+    In-order data, including the reorder ring's bytes once the gap before
+    them is filled, is gathered in a buffer and written WRITE_BUF bytes at
+    a time, by the WriteBehind thread unless --write-queue=0. A resumable
+    transfer's Checkpoint and the digest of a checksummed one are fed every
+    write.
+    """
+    def __init__(self, filename: str, offset: int = 0, truncate: bool = True):
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else 0) | getattr(os, 'O_BINARY', 0)
+        self.fd = os.open(filename, flags, 0o644)
+        self.pending = bytearray();     self.offset = offset    # file offset of pending[0]
+        self.checkpoint = None;     self.digest = None
+        self.jobs = 0       # write-behind jobs not done yet
+
+    def tell(self) -> int:
+        """Offset of the next in-order byte."""
+        return self.offset + len(self.pending)
+
+    def append(self, data: bytes):
+        self.pending += data
+        if len(self.pending) >= WRITE_BUF: self.flush()
+
+    def write_at(self, data, offset: int):
+        data = memoryview(data)
+        while data:
+            if hasattr(os, 'pwrite'):
+                written = os.pwrite(self.fd, data, offset)
+            else:   # Windows has no pwrite
+                os.lseek(self.fd, offset, os.SEEK_SET);    written = os.write(self.fd, data)
+            data = data[written:];  offset += written
+
+    def store(self, data, offset: int): #Write in-order bytes, then feed them to the checkpoint and digest
+        self.write_at(data, offset)
+        if self.checkpoint: self.checkpoint.written(data)
+        if self.digest: self.digest.update(data)
+
+    def flush(self):
+        if not self.pending: return
+        if writer: writer.submit(self, self.pending, self.offset)  # the buffer goes with it
+        else: self.store(self.pending, self.offset)
+        self.offset += len(self.pending);   self.pending = bytearray()
+
+    def close(self):
+        self.flush()
+        if writer: writer.submit(self)  # closed after its writes
+        else: os.close(self.fd)
+
+    def wait(self):
+        """Until the writes and the close queued so far are done."""
+        if writer: writer.wait(self)
+
+class WriteBehind(threading.Thread):
+    """Writes the output files on a thread of its own, so the event loop keeps receiving while the disk is busy.
+
+    OutputFile.flush() hands its buffer over with submit() and the thread
+    writes the jobs in order. They hold at most `capacity` bytes: beyond
+    that submit() blocks the loop, which is why connections with OPT_RWND
+    advertise the room left (Connection.window()) and the senders slow down
+    first. A failed write is raised on the loop by the next submit() or wait().
+    """
+    def __init__(self, capacity: int):
+        super().__init__(daemon=True)
+        self.capacity = capacity
+        self.jobs = collections.deque();    self.cv = threading.Condition()
+        self.queued = 0;    self.pending = 0    # bytes and jobs not done yet
+        self.error = None
+
+    def free(self) -> int:
+        return self.capacity - self.queued
+
+    def submit(self, file, data=None, offset: int = 0):
+        """Queue `data` for `offset` of `file`; without data, closing the file."""
+        size = len(data) if data is not None else 0
+        with self.cv:
+            self.cv.wait_for(lambda: self.error or not self.queued or self.queued + size <= self.capacity)
+            if self.error: raise self.error
+            self.jobs.append((file, data, offset))
+            self.queued += size;    self.pending += 1;  file.jobs += 1
+            self.cv.notify_all()
+
+    def wait(self, file=None):
+        """Until the jobs of `file`, or all jobs, are done."""
+        with self.cv:
+            self.cv.wait_for(lambda: self.error or not (file.jobs if file else self.pending))
+            if self.error: raise self.error
+
+    def run(self):
+        while True:
+            with self.cv:
+                self.cv.wait_for(lambda: self.jobs)
+                file, data, offset = self.jobs.popleft()
+            error = None
+            try:
+                if data is None: os.close(file.fd)
+                else: file.store(data, offset)
+            except OSError as e:
+                error = e
+            with self.cv:
+                self.queued -= len(data) if data is not None else 0
+                self.pending -= 1;  file.jobs -= 1
+                self.error = self.error or error
+                self.cv.notify_all()
+
+def setup_metrics(conns: dict, worker: int): #Live metrics of this process: Reporter for --stats-port / --stats-file, None without them
+    if not (control.stats_port or control.stats_file): return None
+    registry = Registry()
+    def total(field):   # finished connections plus the live ones
+        return lambda: totals[field] + sum(getattr(conn, field) for conn in list(conns.values()))
+    for name, field in (('data_received', 'ori_data_recv'), ('segments_received', 'ori_seg_recv'),
+                        ('dup_segments_received', 'dup_seg_recv'), ('dup_acks_sent', 'dup_seg_snd'),
+                        ('corrupt_segments_received', 'corrupt_seg_recv')):
+        registry.counter(name, total(field))
+    registry.counter('connections', lambda: totals['connections'])
+    registry.counter('idle_closed', lambda: totals['idle_closed'])
+    registry.gauge('active_connections', lambda: len(conns))
+    registry.gauge('reorder_depth', lambda: sum(conn.rcv.reorder.segments for conn in list(conns.values())))
+    registry.gauge('reorder_bytes', lambda: sum(conn.rcv.reorder.buffered for conn in list(conns.values())))
+    if writer: registry.gauge('write_queue', lambda: writer.queued)
+    registry.gauge('max_reorder_depth', lambda: max([totals['max_depth'], *(conn.max_depth for conn in list(conns.values()))]))
+    registry.gauge('per_connection', lambda: [conn.metrics() for conn in list(conns.values())])
+    registry.rate('goodput', total('ori_data_recv'))
+    port, path = control.stats_port, control.stats_file
+    if control.workers > 1:     # every worker reports on its own port / file
+        port = port and port + worker;  path = path and f"{path}.{worker}"
+    reporter = Reporter(registry, port, path, control.stats_interval / 1000)
+    reporter.start()
+    return reporter
+
+def connection_files(addr, worker: int, n: int) -> tuple: #Output file and log of the n-th connection of a worker
+    if not control.server: return control.txt_file_received, 'receiver_log.txt'
+    n = f"{worker}.{n}" if control.workers > 1 else n
+    base = os.path.join(control.txt_file_received, f"{addr[0]}_{addr[1]}_{n}")
+    return base, base + '_log.txt'
+
+def syn_stripe(syn: bytes): #Stripe a SYN asks for, stripe 0 of 1 for a plain transfer
+    stripe = unpack_stripe(unpack_options(parse_packet(syn)[2]).get(OPT_STRIPE, b''))
+    return stripe or Stripe(0, 0, 1, 0, 0, 0)
+
+def stripe_files(addr, stripe: Stripe, filename: str, logname: str) -> tuple: #Shared output file and own log of a stripe
+    if not control.server: return control.txt_file_received, f'receiver_log_{stripe.index}.txt'
+    return os.path.join(control.txt_file_received, f"{addr[0]}_{stripe.session:08x}"), logname
+
+def resume_file(addr, id: bytes, filename: str) -> str: #Output file of a resumable transfer, named after the file in server mode
+    if not control.server: return filename
+    return os.path.join(control.txt_file_received, f"{addr[0]}_{id.hex()[:16]}")
+
+def finish_stripe(conn, verified: bool): #Record a finished stripe; the last one checks the length and digests of the whole file
+    stripe = conn.stripe;   received = conn.file.tell() - stripe.offset
+    unfinished.get(stripe.session, set()).discard(stripe.index)
+    if not unfinished.get(stripe.session, True): del unfinished[stripe.session]
+    # Stripes may finish in different worker processes, so the finished
+    # ones are counted in a locked file next to the output: index, bytes,
+    # and 1 if the stripe's digest matched (or it was not checksummed).
+    with open(conn.filename + '.stripes', 'a+') as done:
+        if fcntl: fcntl.flock(done, fcntl.LOCK_EX)
+        done.write(f"{stripe.index} {received} {int(verified)}\n");  done.flush();  done.seek(0)
+        finished = {index: (int(size), ok == '1') for index, size, ok in (line.split() for line in done)}
+        if len(finished) < stripe.count: return
+        os.truncate(conn.filename, stripe.total);    os.remove(done.name)
+    total = sum(size for size, _ in finished.values())
+    failed = sorted(int(index) for index, (_, ok) in finished.items() if not ok)
+    if total != stripe.total:
+        conn.log.summary(f"\nStriped file incomplete:\t{total} of {stripe.total} bytes\n")
+        print(f"{conn.filename}: striped transfer incomplete, {total} of {stripe.total} bytes", file=sys.stderr)
+    elif failed:
+        conn.log.summary(f"\nStriped file corrupted:\t\tstripes {', '.join(map(str, failed))} failed verification\n")
+        print(f"{conn.filename}: striped transfer corrupted, stripes {', '.join(map(str, failed))} failed verification", file=sys.stderr)
+    elif manifest is not None:
+        record_manifest(conn.addr, total, conn.filename)
+
+def record_manifest(addr, size: int, filename: str): #One line per completed file, a single O_APPEND write keeps workers' lines whole
+    name = os.path.relpath(filename, control.txt_file_received)    # a session's files are in a directory of their own
+    line = f"{time.strftime('%Y-%m-%dT%H:%M:%S')}\t{addr[0]}:{addr[1]}\t{size}\t{name}\n"
+    os.write(manifest, line.encode())
+
+def answer_late_fin(sock, buf, addr, space, checked): #A FIN retransmitted after TIME_WAIT (its ACK was lost): ACK it again
+    if checked and not intact(buf, space): return
+    type, seqno, _ = parse_packet(buf, space, checked)
+    if type != FIN: return
+    try:
+        sock.sendto(make_header(space, ACK, space.add(seqno, 1), b'' if checked else None), addr)
+    except BlockingIOError:
+        pass    # the sender retransmits the FIN again
+
+def parse_argv(argv):
+    min_port = 49152;   max_port = 65535
+    min_win = 1000
+    try:
+        receiver_port = int(argv[1])
+        sender_port = int(argv[2])
+        txt_file_received = argv[3]
+        max_win = int(argv[4])
+        control = Control(receiver_port, sender_port, txt_file_received, max_win)
+        parse_opts(control, argv[NUM_ARGS + 1:], OPTIONS)
+    except ValueError:
+        sys.exit(f"Invalid argument!")
+    
+    if not (min_port <= sender_port <= max_port or min_port <= receiver_port <= max_port):
+        sys.exit(f"Invalid port argument, must be between {min_port} and {max_port}")
+    if max_win < min_win:
+        sys.exit(f"Invalid window argument, must larger or equal than {min_win}")
+    if not 1 <= control.mss <= MAX_MSS:
+        sys.exit(f"Invalid mss option, must be between 1 and {MAX_MSS}")
+    if control.ack_every < 1 or control.ack_delay < 0:
+        sys.exit(f"Invalid ack option, ack-every must be at least 1 and ack-delay not negative")
+    if control.log not in LEVELS or control.log_format not in ('text', 'binary'):
+        sys.exit(f"Invalid log option, log must be one of {', '.join(LEVELS)} and log-format text or binary")
+    if control.stats_interval <= 0:
+        sys.exit(f"Invalid stats-interval option, must be positive")
+    if control.time_wait != 'auto' and not control.time_wait.isdigit():
+        sys.exit(f"Invalid time-wait option, must be milliseconds or auto")
+    if control.write_queue and control.write_queue < 2 * WRITE_BUF:
+        sys.exit(f"Invalid write-queue option, must be 0 or at least {2 * WRITE_BUF}")
+    if control.idle_timeout < 0:
+        sys.exit(f"Invalid idle-timeout option, must not be negative")
+    if control.workers != 1 and not (control.workers > 1 and control.server):
+        sys.exit(f"Invalid workers option, more than 1 worker needs --server=1")
+    if control.workers > 1 and not (hasattr(socket, 'SO_REUSEPORT') and hasattr(os, 'fork')):
+        sys.exit(f"Invalid workers option, this platform has no SO_REUSEPORT")
+
+    return control
+
+#--------------------------------------------------------------------------#
+#------------------------Entrance of the code------------------------------#
+#--------------------------------------------------------------------------#
+if __name__ == "__main__":
+    NUM_ARGS = 4  # Number of command-line arguments
+    OPTIONS = ('rcvbuf', 'sndbuf', 'ack_every', 'ack_delay', 'mss', 'server', 'workers', 'log', 'log_format',
+               'time_wait', 'write_queue', 'idle_timeout', 'stats_port', 'stats_file', 'stats_interval')  # Control fields settable with --name=value
+    TW_RTOS = 4     # --time-wait=auto: sender RTOs in TIME_WAIT, room for two FIN retransmissions (RTO, then 2 RTO backed off) and a margin
+    TW_MIN_RTO = 0.2    # --time-wait=auto: seconds, the sender's default --min-rto, below which its RTO never drops
+    CLOSED_MAX = 1024   # Connections past TIME_WAIT whose FIN is still ACKed in server mode
+    WRITE_BUF = 256 * 1024    # In-order bytes gathered before one write
+    WINDOW_POLL = 0.005     # Seconds between checks of a shrunk window for room to announce
+    control: Control;   selector: selectors.BaseSelector
+    writer = None       # WriteBehind thread of this process, None with --write-queue=0
+    manifest = None     # fd of <dir>/manifest.txt in server mode, shared by all workers
+    unfinished = {}     # striped transfer session -> stripe indices not finished yet
+    totals = collections.Counter()  # counters of the finished connections, for the metrics
     main()
\ No newline at end of file
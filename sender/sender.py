@@ -1,13 +1,35 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import hashlib
+import math
+import mmap
+import os
 import random
+import select
+import selectors
 import socket
+import subprocess
 import sys
 import threading
 import time
 from dataclasses import dataclass
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stp.packet import (DATA, ACK, SYN, FIN, HDR, MAX_MSS, DIGEST_SIZE, DEFAULT_MSS, OPT_MSS, OPT_SEQ32, OPT_WINDOW,
+                        OPT_STRIPE, OPT_COMPRESS, OPT_RESUME, OPT_CHECKSUM, OPT_FILES, OPT_RWND, Stripe, make_header, parse_packet, intact, pack_options, unpack_options, pack_stripe, path_mss)
+from stp.seqnum import SEQ16, SEQ32
+from stp.rto import RtoEstimator
+from stp.congestion import CONGESTION
+from stp.log import LEVELS, PacketLog
+from stp.metrics import Registry, Histogram, Reporter
+from stp.compress import METHODS, Deflater, offer
+from stp.resume import file_id
+from stp.pacing import Pacer, cwnd_rate
+from stp.multifile import FileStream
+from stp.flight import Segment, InFlight, SendWindow
+from stp.cli import parse_opts, set_buffers, recv_batch
+
 @dataclass
 class Control:
     """Control block: parameters for the sender program."""
@@ -18,135 +40,412 @@ class Control:
     rto: int;    flp: float;    rlp: float
     socket: socket.socket          
     is_alive: bool = True
-    ori_data_recv: int = 0; orig_data_snd: int = 0
+    orig_data_snd: int = 0
     ori_seg_snd: int = 0;   resend_seg: int = 0;    snd_seg_drp: int = 0
-    dup_ack_recv: int = 0;  ack_drp: int = 0
+    ack_drp: int = 0;   ack_corrupt: int = 0;   window_probes: int = 0
+    min_rto: int = 200      # --min-rto: ms, floor of the adaptive RTO; keep it well above the wheel's 5ms tick
+    cc: str = 'reno'        # --cc: congestion control algorithm, see CONGESTION
+    cwnd_log: str = ''      # --cwnd-log: file that records cwnd/ssthresh over time
+    rcvbuf: int = 0;    sndbuf: int = 0     # --rcvbuf/--sndbuf: socket buffer bytes, 0 = OS default
+    mss: int = DEFAULT_MSS  # --mss: largest payload offered in the SYN, 0 = from the path MTU
+    log: str = 'packet'     # --log: off, summary or packet (every segment)
+    log_format: str = 'text'    # --log-format: text or binary (decode with python -m stp.log)
+    seed: int = 0           # --seed: makes the flp/rlp drops reproducible, 0 = unseeded
+    compress: str = 'off'   # --compress: off, zlib or lzma, used if the receiver accepts it in the SYN ACK
+    checksum: int = 0       # --checksum: 1 = CRC32 in every header and a file digest in the FIN, if the receiver accepts
+    pace: int = 0           # --pace: 1 = spread new segments over the RTT at cwnd/SRTT instead of bursting them
+    max_rate: int = 0       # --max-rate: bytes/s cap of the transfer (paced, split over the stripes), 0 = none
+    read_ahead: int = 8 * 1024 * 1024   # --read-ahead: bytes a thread reads into the page cache ahead of sending, 0 = off
+    resume: int = 0         # --resume: 1 = continue where an earlier run for this file stopped (receiver keeps a checkpoint)
+    stats_port: int = 0     # --stats-port: serve JSON snapshots of the metrics on 127.0.0.1:PORT
+    stats_file: str = ''    # --stats-file: rewrite this JSON snapshot every --stats-interval ms
+    stats_interval: int = 1000
+    stripes: int = 1        # --stripes: flows (processes) the file is split across
+    stripe: int = -1;   session: int = 0    # set by --stripes for its children: index and transfer id
+    multi: bool = False     # txt_file_to_send is a directory, its files go in one multi-file session
 #--------------------------------------------------------------------------#
 #---------------------------------Main body--------------------------------#
 #--------------------------------------------------------------------------#
 def main():
-    if len(sys.argv) != NUM_ARGS + 1:
-        sys.exit(f"Usage: {sys.argv[0]} port wait_time")
-    global window, remainWin, startTime, log, control
+    if len(sys.argv) < NUM_ARGS + 1:
+        sys.exit(f"Usage: {sys.argv[0]} sender_port receiver_port txt_file_to_send max_win rto flp rlp [--option=value ...]")
+    global startTime, log, control, rtt, cc, cwnd_log, seq, rtt_hist, drop_rng, deflater, checked, pacer, flight
     control = parse_argv(sys.argv)
+    if control.stripes > 1 and control.stripe < 0:
+        control.socket.close();     sys.exit(send_striped(sys.argv))
+    log = PacketLog('sender_log.txt ' if control.stripe < 0 else f'sender_log_{control.stripe}.txt',
+                    LEVELS[control.log], control.log_format == 'binary')
+    rtt = RtoEstimator(control.rto, wheel.tick, control.min_rto / 1000)
+    drop_rng = random.Random(f"{control.seed}/{control.stripe}" if control.seed else None)
+    reporter = setup_metrics()
+    cwnd_log = open(control.cwnd_log, 'w') if control.cwnd_log else None
 
     #-------------------------SYN_SENT-----------------------#
-    seqno = random.randrange(2**16)
-    control.socket.settimeout(control.rto);     startTime = time.time()
-    remainWin = control.max_win;    send_pkt(SYN, seqno)
+    isn = random.randrange(SEQ32.mod);  seqno = isn % SEQ16.mod    # the SYN header is always 16 bit
+    control.socket.settimeout(rtt.rto);     startTime = log.start = time.time()
+    mss = min(control.mss or path_mss(control.socket), control.max_win)
+    options = {OPT_MSS: mss.to_bytes(2, 'big')}
+    if control.max_win >= SEQ16.half: options[OPT_SEQ32] = SEQ32.pack(isn)    # window needs 32-bit seqnos
+    if control.stripe >= 0:
+        stripe = stripe_range(os.path.getsize(control.txt_file_to_send));  options[OPT_STRIPE] = pack_stripe(stripe)
+    if control.compress != 'off': options[OPT_COMPRESS] = offer(control.compress)
+    if control.resume: options[OPT_RESUME] = file_id(control.txt_file_to_send)
+    if control.checksum: options[OPT_CHECKSUM] = b''
+    if control.multi: options[OPT_FILES] = b''
+    options[OPT_RWND] = b''     # a receiver that writes behind advertises the room it has left
+    syn = pack_options(options)
+    send_pkt(SYN, seqno, syn)
 
     while control.is_alive:
         try:
             pkt = control.socket.recv(1024)
             if int.from_bytes(pkt[:2], 'big') == 1:
-                seqno = (seqno + 1) % 65536
-                window.pop(seqno)
+                seqno = SEQ16.add(seqno, 1)
+                entry = window.release(seqno)[0]
+                if not entry.retx: rtt_sample(time.monotonic() - entry.sent_at)
                 record_log('rcv', t[1], seqno, 0)
+                options = unpack_options(pkt[HDR:])     # a receiver without options takes DEFAULT_MSS
+                if OPT_SEQ32 in options:
+                    seq = SEQ32;    seqno = SEQ32.add(isn, 1)
+                peer_win = int.from_bytes(options.get(OPT_WINDOW, b''), 'big') or control.max_win
+                control.max_win = min(control.max_win, peer_win, seq.half - 1)
+                peer_mss = int.from_bytes(options.get(OPT_MSS, DEFAULT_MSS.to_bytes(2, 'big')), 'big')
+                control.mss = min(mss, peer_mss, control.max_win)
+                if control.stripe >= 0 and OPT_STRIPE not in options:
+                    sys.exit(f"Receiver does not support striped transfers")
+                if control.multi and OPT_FILES not in options:
+                    sys.exit(f"Receiver does not support multi-file sessions")
+                method = options.get(OPT_COMPRESS, b'\0')[0]   # 0: the receiver wants the raw stream
+                resume_at = int.from_bytes(options.get(OPT_RESUME, b''), 'big')    # bytes the receiver already has
+                checked = OPT_CHECKSUM in options   # from here on every header carries a CRC32
                 break
         except socket.timeout:
-            send_pkt(SYN, seqno);  continue
-    control.socket.settimeout(None)
+            rtt.backoff();  control.socket.settimeout(rtt.rto)
+            send_pkt(SYN, seqno, syn);  continue
+    control.socket.setblocking(False)   # from now on the listener waits on a selector
+    cc = CONGESTION[control.cc](control.mss, control.max_win)
+    flight = SendWindow(window, seq, control.max_win, rtt, cc, time.monotonic, resend, lambda entry: wheel.cancel(entry.end),
+                        rtt_sample, record_cwnd, OPT_RWND in options)
+    if control.pace or control.max_rate: pacer = Pacer(pace_rate)
 
     #--------------------Established & Finish state-------------------#
-    filename = f'{control.txt_file_to_send}'
-    with open(filename, 'r') as file:
-        file = file.read().encode();    i = 1000
-        seqno = send_pkt(DATA, seqno, file[0: i])
-        control.orig_data_snd+=len(file[0: i]); control.ori_seg_snd+=1
-        listener = threading.Thread(target=listen_thread, args=());    listener.start()
-        timer = RepeatTimer(control.rto, resend_pkt, args=(next(iter(window.values())), )); timer.start()
-
-        while control.is_alive:
-            if i < len(file) and remainWin >= len(file[i:i+1000]):
-                data = file[i:i+1000];  i += 1000
+    if control.multi:   # every file of the directory, framed into one stream
+        paths = [os.path.join(control.txt_file_to_send, name) for name in list_files(control.txt_file_to_send)]
+        file = FileStream([(os.path.basename(path), path, os.path.getsize(path)) for path in paths], load_file)
+        extents = file.extents()
+    else:
+        file = map_file(control.txt_file_to_send);  base = 0
+        if control.stripe >= 0: file = file[stripe.offset:stripe.offset + stripe.length];   base = stripe.offset
+        if resume_at > len(file):
+            sys.exit(f"Receiver resumes at byte {resume_at}, beyond the end of the file")
+        if resume_at: file = file[resume_at:]   # only the missing tail is sent
+        extents = [(0, control.txt_file_to_send, base + resume_at, len(file))]
+    if method:  # segments are cut from the framed, compressed stream
+        source = deflater = Deflater(file, method, lambda: rtt.srtt and min(cc.cwnd, control.max_win) / rtt.srtt)
+    else:
+        source = FileSource(file)
+    if checked: source.digest = hashlib.blake2b(digest_size=DIGEST_SIZE)    # of the file bytes, for the FIN
+    readahead = ReadAhead(extents, source, control.read_ahead) if control.read_ahead else None
+    if readahead: readahead.start()
+    listener = threading.Thread(target=listen_thread, args=());    listener.start()
+
+    data = source.read(control.mss)
+    while True:
+        with window_cv:     # sleep until the listener frees enough window space
+            while not window_cv.wait_for(lambda: not control.is_alive or not data or flight.can_send(len(data)),
+                                         rtt.rto if flight.rwnd is not None else None):
+                if flight.shut(): window_probe(seqno)   # no ACK is due to reopen the receiver's window
+            if not control.is_alive: break
+            while data and flight.can_send(len(data)):   # the whole burst in one go, unless paced
+                pause = pacer and pacer.delay(len(data))
+                if pause:
+                    window_cv.wait(pause);  continue    # the listener keeps the lock meanwhile
                 seqno = send_pkt(DATA, seqno, data)
                 control.ori_seg_snd+=1;     control.orig_data_snd += len(data)
-
-                timer.cancel()
-                timer = RepeatTimer(control.rto, resend_pkt, args=(next(iter(window.values())), ))
-                timer.start()
-            #--------------Closing state---------------------#
-            if i>=len(file) and remainWin == control.max_win : 
-                timer.cancel()
-                send_pkt(FIN, seqno)
-                timer = RepeatTimer(control.rto, resend_pkt, args=(next(iter(window.values())), ))
-                timer.start()
+                data = source.read(control.mss, compress=False)
+            if data is not None and not data:
+                #--------------Closing state---------------------#
+                window_cv.wait_for(lambda: not control.is_alive or not window.bytes)
+                send_pkt(FIN, seqno, source.digest.digest() if source.digest else b'')
                 break
+        if data is None: data = source.read(control.mss)    # compress the next blocks outside the window lock
+        if readahead: readahead.advance()
     #------------------------FIN_WAIT------------------------#
-    with threading.Lock(): control.socket.settimeout(2)
-    while control.is_alive:
-        if not window:
-            timer.cancel(); listener.join()
-            control.is_alive = False
-        else:
-            continue
+    with window_cv:
+        window_cv.wait_for(lambda: not window or not control.is_alive)
+    wheel.stop(); listener.join()
+    if reporter: reporter.stop()
+    control.is_alive = False
     
     control.socket.close()
-    log.write(f"\nOriginal data sent:\t\t\t{control.orig_data_snd}\n")
-    log.write(f"Original data acked:\t\t{control.ori_data_recv}\n")
-    log.write(f"Original segments sent:\t\t{control.ori_seg_snd}\n")
-    log.write(f"Retransmitted segments:\t\t{control.resend_seg}\n")
-    log.write(f"Dup acks received:\t\t\t{control.dup_ack_recv}\n")
-    log.write(f"Data segments dropped:\t\t{control.snd_seg_drp}\n")
-    log.write(f"Ack segments dropped:\t\t{control.ack_drp}\n")
+    log.summary(f"\nOriginal data sent:\t\t\t{control.orig_data_snd}\n")
+    log.summary(f"Original data acked:\t\t{flight.acked}\n")
+    log.summary(f"Original segments sent:\t\t{control.ori_seg_snd}\n")
+    log.summary(f"Retransmitted segments:\t\t{control.resend_seg}\n")
+    log.summary(f"Dup acks received:\t\t\t{flight.dup_acks}\n")
+    log.summary(f"Data segments dropped:\t\t{control.snd_seg_drp}\n")
+    log.summary(f"Ack segments dropped:\t\t{control.ack_drp}\n")
+    if checked: log.summary(f"Corrupt acks discarded:\t\t{control.ack_corrupt}\n")
+    if control.window_probes: log.summary(f"Zero window probes sent:\t{control.window_probes}\n")
+    if control.multi: log.summary(f"Files sent:\t\t\t\t{file.count}\n")
+    if resume_at: log.summary(f"Resumed at byte:\t\t\t{resume_at}\n")
+    if deflater:
+        log.summary(f"File data compressed:\t\t{len(file)} -> {deflater.framed}\n")
+        log.summary(f"Blocks compressed / raw:\t{deflater.compressed} / {deflater.raw}\n")
     log.close()
+    if cwnd_log: cwnd_log.close()
     sys.exit(0)
 #--------------------------------------------------------------------------#
 #------------------------Self defined functions----------------------------#
 #--------------------------------------------------------------------------#
 def send_pkt(type: int, seqno: int, data = b''): #Any packet send out from sender will through this function
-    global startTime, log, window, remainWin, control
-    pkt = type.to_bytes(2, "big")
-    pkt += seqno.to_bytes(2, "big");    pkt += data
+    global startTime, log, control
+    hdr = make_header(seq, type, seqno, data if checked else None)
     if not drop(control.flp):
-        control.socket.send(pkt)
+        transmit(hdr, data)
         record_log('snd', t[type], seqno, len(data))
     else:
         record_log('drp', t[type], seqno, len(data))
+        control.snd_seg_drp += 1 if type == DATA else 0
 
 
-    len_data = len(data) if len(data) else 1
-    seqno = (seqno + len_data) % 65536
-    with threading.Lock():
-        window[seqno] = (type, pkt);   remainWin -= len(data) 
+    end = seq.add(seqno, len(data) if type == DATA else 1)     # SYN/FIN take one seqno, options or not
+    with window_cv:
+        entry = window.get(end)
+        if entry is None:
+            window.append(Segment(type, seqno, end, hdr, data, time.monotonic()))
+        else:   # a repeated SYN
+            entry.sent_at = time.monotonic();   entry.retx += 1
+        if type != SYN: wheel.schedule(end, rtt.rto, on_timeout, end)
+    return end
 
-    global control, window, remainWin, log
-    cnt = 0; last_seqno = 65536; rcv_type = 1
+def listen_thread(): #Receive ACKs in batches, the SendWindow releases the window and runs fast retransmit / recovery
+    global control, log
+    rcv_type = ACK
+    selector = selectors.DefaultSelector();  selector.register(control.socket, selectors.EVENT_READ)
 
-    while control.is_alive:
-        try:
-            recv = control.socket.recv(1024)
+    while control.is_alive and rcv_type != FIN:
+        batch = recv_batch(selector, control.socket.recv, 1024, LISTEN_POLL)
+        if not batch: continue
+        with window_cv:     # one lock round trip and one wake-up per batch
+            for recv in batch:
+                if checked and not intact(recv, seq):
+                    control.ack_corrupt += 1;   continue
+                (_, seqno, payload) = parse_packet(recv, seq, checked)
 
-            if not drop(control.rlp):
+                if drop(control.rlp):
+                    record_log('drp', t[1], seqno, 0);  control.ack_drp += 1
+                    continue
                 record_log('rcv', t[1], seqno, 0)
-                cnt = cnt + 1 if last_seqno == seqno else 1
-                last_seqno = seqno
-                if seqno in window:
-                    with threading.Lock():
-                        while window and (seqno - next(iter(window))+ 65536) % 65536 <= control.max_win: 
-                            (rcv_type, pkt) = window.pop(next(iter(window))) 
-                            control.ori_data_recv += (len(pkt) -4)
-                            remainWin += (len(pkt) - 4)
-    global log, startTime
-    with threading.Lock():
-        log.write(f"{kind}\t %7.2f\t\t {type}\t {seqno}\t {length}\n" %((time.time() - startTime)*1000))
-
-def drop(rate):
-    random.seed()
-    rand = random.random()
-    if rand < rate: return True
-    else:   return False
-
-class RepeatTimer(threading.Timer):
+                released = flight.on_ack(seqno, payload)
+                if released: rcv_type = released[-1].type
+                if rcv_type == FIN: break
+            window_cv.notify_all()
+    selector.close()
+    with window_cv: window_cv.notify_all()
+
+def resend(entry): #Retransmit for the SendWindow: resend and re-arm the deadline
+    resend_pkt(entry)
+    wheel.schedule(entry.end, rtt.rto, on_timeout, entry.end)
+
+def window_probe(seqno): #An empty segment at the next seqno: the receiver answers with an ACK carrying its window
+    transmit(make_header(seq, DATA, seqno, b'' if checked else None), b'')
+    control.window_probes += 1;     record_log('snd', t[DATA], seqno, 0)
+
+def pace_rate() -> float: #Bytes/s to pace new segments at: cwnd/SRTT with --pace, at most this stripe's share of --max-rate
+    rate = cwnd_rate(cc, rtt.srtt, control.max_win) if control.pace else 0
+    cap = control.max_rate / control.stripes
+    return min(rate, cap) if rate and cap else rate or cap
+
+def rtt_sample(r: float): #Feed a valid RTT sample (Karn's algorithm) to the estimator and the histogram
+    rtt.sample(r);  rtt_hist.add(r)
+
+def setup_metrics(): #Live metrics: Reporter for --stats-port / --stats-file, None without them
+    global rtt_hist
+    registry = Registry();  rtt_hist = registry.histogram('rtt')
+    for name, field in (('data_sent', 'orig_data_snd'), ('segments_sent', 'ori_seg_snd'), ('retransmitted', 'resend_seg'),
+                        ('data_dropped', 'snd_seg_drp'), ('acks_dropped', 'ack_drp'), ('acks_corrupt', 'ack_corrupt')):
+        registry.counter(name, lambda field=field: getattr(control, field))
+    for name, field in (('data_acked', 'acked'), ('timeouts', 'timeouts'), ('fast_retransmits', 'fast_retx'), ('dup_acks', 'dup_acks')):
+        registry.counter(name, lambda field=field: getattr(flight, field) if flight else 0)    # the SendWindow's, after the handshake
+    registry.gauge('cwnd', lambda: cc and round(cc.cwnd));    registry.gauge('ssthresh', lambda: cc and round(cc.ssthresh))
+    registry.gauge('srtt', lambda: rtt.srtt);   registry.gauge('rto', lambda: rtt.rto)
+    registry.gauge('window', lambda: control.max_win)
+    registry.gauge('in_flight', lambda: window.bytes)
+    registry.gauge('in_flight_segments', lambda: len(window))
+    registry.gauge('peer_window', lambda: flight and flight.rwnd)
+    registry.counter('window_probes', lambda: control.window_probes)
+    registry.gauge('pacing_rate', lambda: pacer and cc and round(pace_rate()))
+    registry.counter('blocks_compressed', lambda: deflater.compressed if deflater else 0)
+    registry.counter('blocks_raw', lambda: deflater.raw if deflater else 0)
+    registry.rate('goodput', lambda: flight.acked if flight else 0)
+    if not (control.stats_port or control.stats_file): return None
+    port, path = control.stats_port, control.stats_file
+    if control.stripe >= 0:     # every stripe process reports on its own port / file
+        port = port and port + control.stripe;  path = path and f"{path}.{control.stripe}"
+    reporter = Reporter(registry, port, path, control.stats_interval / 1000)
+    reporter.start()
+    return reporter
+
+def record_cwnd():
+    global cwnd_log, startTime, cc
+    if cwnd_log:
+        cwnd_log.write(f"{(time.time() - startTime)*1000:.2f}\t{cc.cwnd:.0f}\t{cc.ssthresh:.0f}\n")
+
+def record_log(kind, type, seqno, length):
+    log.packet(kind, type, seqno, length)   # queued, the log's writer thread formats and writes it
+
+def drop(rate): #Emulated loss; one generator for the whole run, seeded by --seed
+    return rate > 0 and drop_rng.random() < rate
+
+class TimerWheel(threading.Thread):
+    """Hashed timing wheel: a single thread drives every retransmission deadline.
+
+    Each key lives in exactly one slot dict, so schedule() and cancel() are
+    O(1); deadlines further away than one revolution carry a rounds counter.
+    The thread sleeps on its condition while the wheel is empty.
+    """
+    def __init__(self, tick: float = 0.005, size: int = 512):
+        super().__init__(daemon=True)
+        self.tick = tick;   self.size = size
+        self.slots = [{} for _ in range(size)]
+        self.where = {}                     # key -> slot index
+        self.cursor = 0;    self.next_tick = 0.0
+        self.cv = threading.Condition();    self.running = True
+
+    def schedule(self, key, delay: float, callback, *args):
+        """(Re-)arm the deadline of `key`, `delay` seconds from now."""
+        with self.cv:
+            self.cancel(key)
+            if not self.where:              # idle wheel, restart the clock
+                self.next_tick = time.monotonic() + self.tick;    self.cv.notify()
+            # The slot at cursor+n fires at next_tick + (n-1) ticks, never before now + delay.
+            ticks = max(1, math.ceil((time.monotonic() + delay - self.next_tick) / self.tick) + 1)
+            slot = (self.cursor + ticks) % self.size
+            self.slots[slot][key] = [(ticks - 1) // self.size, callback, args]
+            self.where[key] = slot
+
+    def cancel(self, key):
+        with self.cv:
+            slot = self.where.pop(key, None)
+            if slot is not None: del self.slots[slot][key]
+
+    def stop(self):
+        with self.cv:
+            self.running = False;   self.cv.notify()
+
+    def run(self):
+        while True:
+            with self.cv:
+                self.cv.wait_for(lambda: self.where or not self.running)
+                if not self.running: return
+                delay = self.next_tick - time.monotonic()
+                if delay > 0:
+                    self.cv.wait(delay);    continue
+                self.cursor = (self.cursor + 1) % self.size;  self.next_tick += self.tick
+                slot = self.slots[self.cursor];     due = []
+                for key, entry in list(slot.items()):
+                    if entry[0]:
+                        entry[0] -= 1
+                    else:
+                        del slot[key], self.where[key];   due.append(entry)
+            for _, callback, args in due:   # fire outside the wheel lock
+                callback(*args)
+
+def resend_pkt(entry): #will retransmit the file while timeout
+    global control
+    transmit(entry.hdr, entry.data)
+    entry.sent_at = time.monotonic();   entry.retx += 1
+    control.resend_seg += 1
+    if pacer: pacer.charge(len(entry.data))
+    record_log('snd', t[entry.type], entry.seqno, len(entry.data))
+
+def transmit(hdr: bytes, data): #Scatter/gather send: header and payload view are never joined
+    while True:
+        try:
+            if SENDMSG: control.socket.sendmsg((hdr, data))
+            else:       control.socket.send(hdr + bytes(data))
+            return
+        except BlockingIOError:     # send buffer full, wait until it drains
+            select.select([], [control.socket], [])
+
+class ReadAhead(threading.Thread):
+    """Reads the stream's files into the page cache up to `limit` bytes ahead of `source.pos`.
+
+    Segments are views of the mapping, so a page that is not cached yet
+    would be read from disk inside sendmsg, on the main thread and with the
+    GIL held. This thread reads it first, READ_CHUNK bytes at a time with
+    readinto(), which releases the GIL: the disk and the network overlap.
+    `extents` are (stream offset, path, file offset, length) of the file
+    data in stream order.
+    """
+    def __init__(self, extents: list, source, limit: int):
+        super().__init__(daemon=True)
+        self.extents = extents;     self.source = source;   self.limit = limit
+        self.cv = threading.Condition()
+
     def run(self):
-        while not self.finished.wait(self.interval):
-            self.function(*self.args, **self.kwargs)
+        buf = memoryview(bytearray(READ_CHUNK))
+        for start, path, offset, length in self.extents:
+            with open(path, 'rb', buffering=0) as file:
+                file.seek(offset);  done = 0
+                while done < length:
+                    with self.cv:   # backpressure: no further ahead than limit
+                        self.cv.wait_for(lambda: not control.is_alive or start + done < self.source.pos + self.limit)
+                    if not control.is_alive: return
+                    size = file.readinto(buf[:min(READ_CHUNK, length - done)])
+                    if not size: break
+                    done += size
+
+    def advance(self):
+        """The source moved on: maybe room to read further."""
+        with self.cv: self.cv.notify()
+
+class FileSource:
+    """The raw stream: segments are zero-copy slices of the mapped file (see Deflater for the other one)."""
+    def __init__(self, data: memoryview):
+        self.data = data;   self.pos = 0
+        self.digest = None  # hash object fed every byte read
+
+    def read(self, size: int, compress: bool = True) -> memoryview:
+        view = self.data[self.pos:self.pos + size]
+        self.pos += len(view)
+        if self.digest: self.digest.update(view)
+        return view
+
+def list_files(directory: str) -> list: #Names of the regular files in a directory, the order they are sent in
+    return sorted(name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name)))
+
+def map_file(filename: str) -> memoryview:
+    """Memory-map the file to send, segments are zero-copy slices of the returned view."""
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0: return memoryview(b'')
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+def load_file(filename: str): #A file of a multi-file session, when the stream reaches it: read whole if small, else mapped
+    if os.path.getsize(filename) >= SMALL_FILE: return map_file(filename)
+    with open(filename, 'rb') as file: return file.read()
+
+def on_timeout(key): #Deadline of one in-flight segment expired: the SendWindow resends it
+    with window_cv:
+        segment = window.get(key)
+        if segment is not None and segment.type == FIN and segment.retx >= FIN_RETRIES:
+            log.summary(f"\nFIN unacknowledged:\t\tgave up after {segment.retx} retransmissions\n")
+            control.is_alive = False;   window_cv.notify_all()  # every data byte was acknowledged before the FIN
+            return
+        flight.on_timeout(key)
+
+def send_striped(argv: list) -> int: #Start one sender process per stripe, each its own flow from its own port
+    session = random.randrange(1 << 32);    procs = []
+    for stripe in range(control.stripes):
+        args = [str(control.sender_port + stripe), *argv[2:], f'--stripe={stripe}', f'--session={session}']
+        procs.append(subprocess.Popen([sys.executable, argv[0], *args]))
+    return max(proc.wait() for proc in procs)
 
-def resend_pkt(value): #will retransmit the file while timeout
-    (type, pkt) = value
-    global control, window
-    control.socket.send(pkt)
-    seqno = int.from_bytes(pkt[2:4], 'big')
+def stripe_range(total: int) -> Stripe: #Byte range this process sends, stripes differ by at most one byte
+    offset = total * control.stripe // control.stripes
+    length = total * (control.stripe + 1) // control.stripes - offset
+    return Stripe(control.session, control.stripe, control.stripes, offset, length, total)
 
 def setup_socket(remote, sender_port, receiver_port):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -169,6 +468,8 @@ def parse_argv(argv: list) -> Control:
 
         host = '127.0.0.1';     socket = setup_socket(host, sender_port, receiver_port)
         control = Control(sender_port, receiver_port, txt_file_to_send, max_win, rto, flp, rlp, socket)
+        parse_opts(control, argv[NUM_ARGS + 1:], OPTIONS)
+        set_buffers(socket, control.rcvbuf, control.sndbuf)
     except ValueError:
         sys.exit(f"Invalid argument!")
     
@@ -180,6 +481,31 @@ def parse_argv(argv: list) -> Control:
         sys.exit(f"Invalid flp argument, must within [0, 1]")
     if not (0<= control.rlp <=1):
         sys.exit(f"Invalid rlp argument, must within [0, 1]")
+    if not 0 <= control.mss <= MAX_MSS:
+        sys.exit(f"Invalid mss option, must be between 1 and {MAX_MSS} (0 for the path MTU)")
+    if control.cc not in CONGESTION:
+        sys.exit(f"Invalid cc option, must be one of {', '.join(CONGESTION)}")
+    if control.log not in LEVELS or control.log_format not in ('text', 'binary'):
+        sys.exit(f"Invalid log option, log must be one of {', '.join(LEVELS)} and log-format text or binary")
+    if control.compress not in ('off', *METHODS):
+        sys.exit(f"Invalid compress option, must be off or one of {', '.join(METHODS)}")
+    if control.stats_interval <= 0:
+        sys.exit(f"Invalid stats-interval option, must be positive")
+    if not 1 <= control.stripes <= max_port - control.sender_port + 1 or control.stripe >= control.stripes:
+        sys.exit(f"Invalid stripes option, stripes use ports sender_port to sender_port+stripes-1")
+    if control.stripe < 0 and 0 <= control.receiver_port - control.sender_port < control.stripes:   # checked once, by the parent
+        sys.exit(f"Invalid stripes option, ports {control.sender_port} to {control.sender_port + control.stripes - 1} include the receiver_port")
+    if control.read_ahead < 0:
+        sys.exit(f"Invalid read-ahead option, must not be negative")
+    if control.min_rto < MIN_RTO_FLOOR:
+        sys.exit(f"Invalid min-rto option, must be at least {MIN_RTO_FLOOR}ms, several timer wheel ticks")
+    if control.max_rate < 0:
+        sys.exit(f"Invalid max-rate option, must not be negative")
+    control.multi = os.path.isdir(control.txt_file_to_send)
+    if control.multi and (control.stripes > 1 or control.resume):
+        sys.exit(f"Invalid file argument, a directory is sent as one session, without stripes or resume")
+    if control.resume and control.stripes > 1:
+        sys.exit(f"Invalid resume option, striped transfers cannot be resumed")
     return control
 
 #--------------------------------------------------------------------------#
@@ -187,9 +513,24 @@ def parse_argv(argv: list) -> Control:
 #--------------------------------------------------------------------------#
 if __name__ == "__main__":
     NUM_ARGS  = 7  # Number of command-line arguments
-    DATA = 0;   ACK = 1;    SYN = 2;    FIN = 3
+    OPTIONS = ('cc', 'cwnd_log', 'rcvbuf', 'sndbuf', 'mss', 'log', 'log_format', 'seed', 'compress', 'resume',   # Control fields settable with --name=value
+               'checksum', 'pace', 'max_rate', 'read_ahead', 'min_rto', 'stats_port', 'stats_file', 'stats_interval', 'stripes', 'stripe', 'session')
+    SENDMSG = hasattr(socket.socket, 'sendmsg')     # not available on Windows
+    MIN_RTO_FLOOR = 20  # Smallest --min-rto, ms: 4 ticks of the timer wheel
+    LISTEN_POLL = 0.5   # Seconds the listener waits before re-checking is_alive
+    FIN_RETRIES = 5     # FIN retransmissions before the sender stops waiting for the receiver, long gone past TIME_WAIT
     t = {0: 'DATA', 1:'ACK', 2:'SYN', 3:'FIN'}
-    window = {};   remainWin = 0;   startTime = 0
-    log = open('sender_log.txt ', 'w+')
+    window = InFlight();    startTime = 0
+    seq = SEQ16     # sequence space, SEQ32 once negotiated
+    window_cv = threading.Condition()   # guards window, flight and every entry in them, signalled on every release
+    wheel = TimerWheel();   wheel.start()
+    rtt: RtoEstimator;  log: PacketLog;     rtt_hist: Histogram;    drop_rng: random.Random
+    deflater = None     # Deflater of a compressed transfer
+    checked = False     # headers carry a CRC32 (OPT_CHECKSUM accepted)
+    pacer = None        # Pacer of --pace / --max-rate
+    flight = None       # SendWindow over `window`, once the handshake is done
+    READ_CHUNK = 1024 * 1024    # bytes read ahead at a time
+    SMALL_FILE = 64 * 1024      # files of a multi-file session below this are read, not mapped
+    cc = None
     control: Control
     main()
\ No newline at end of file
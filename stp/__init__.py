@@ -0,0 +1,4 @@
+"""STP: the protocol modules shared by sender/sender.py and receiver/receiver.py,
+and an asyncio API (stp.connection) for running transfers inside one process."""
+
+from .connection import STPConnection, STPServer, open_connection, start_server
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Helpers shared by the command line programs: the sender, the receiver,
+the emulator and the benchmark.
+
+Each program keeps its parameters in a Control dataclass; parse_opts()
+sets its fields from `--name=value` arguments, converting the value with
+the field's type. recv_batch() drains a socket's queued datagrams in one
+wake-up, so a busy socket costs one select() per batch, not per datagram.
+"""
+
+import socket
+import sys
+from dataclasses import fields
+
+BATCH = 64              # datagrams drained per wake-up
+
+def parse_opts(control, opts: list, names):
+    """Apply `--name=value` options onto the Control field of the same name; `names` are the ones that may be set.
+
+    Dashes in a name stand for underscores. An unknown or malformed option
+    exits with a message, a value of the wrong type raises ValueError.
+    """
+    types = {f.name: f.type for f in fields(control)}
+    for opt in opts:
+        name, sep, value = opt[2:].partition('=')
+        name = name.replace('-', '_')
+        if not opt.startswith('--') or not sep or name not in names or name not in types:
+            sys.exit(f"Invalid option: {opt}")
+        setattr(control, name, types[name](value))
+
+def set_buffers(sock: socket.socket, rcvbuf: int, sndbuf: int):
+    """Set the socket's buffer sizes, 0 keeps the OS default."""
+    if rcvbuf: sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sndbuf: sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+
+def recv_batch(selector, recv, size: int, timeout) -> list:
+    """Wait up to `timeout` until the selector is readable, then drain every queued datagram (at most BATCH) with `recv(size)`."""
+    batch = []
+    if selector.select(timeout):
+        while len(batch) < BATCH:
+            try:
+                batch.append(recv(size))
+            except (BlockingIOError, InterruptedError):
+                break
+            except (ConnectionRefusedError, ConnectionResetError):  # ICMP error of an earlier send (Windows: reset), not a datagram
+                continue
+    return batch
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Block compression of the byte stream, negotiated with OPT_COMPRESS in the SYN.
+
+The sender cuts the file into BLOCK-byte blocks before segmentation and
+sends each as a frame: a FRAME header (method, length) followed by the
+block compressed with zlib or lzma, or as it is. A block is only sent
+compressed if that made it smaller, and when compressing stops paying
+off (it saved less than MIN_SAVING, or took longer than sending the bytes
+it saved would) the next blocks skip it, twice as many each time, up to
+MAX_SKIP. The receiver feeds every in-order byte to an Inflater, which
+decompresses frames as they arrive.
+"""
+
+import struct
+import time
+import zlib
+try:
+    import lzma
+except ImportError:     # Python built without liblzma
+    lzma = None
+
+RAW = 0;    ZLIB = 1;   LZMA = 2
+METHODS = {'zlib': ZLIB, **({'lzma': LZMA} if lzma else {})}   # name -> method, in order of preference
+FRAME = struct.Struct('!BI')    # method, length of the frame's payload
+BLOCK = 64 * 1024       # file bytes compressed at a time
+MIN_SAVING = 0.05       # share of a block compression must save to be kept on
+MAX_SKIP = 64           # most blocks sent raw before compression is tried again
+ZLIB_LEVEL = 1;     LZMA_PRESET = 0     # fast settings: the sending thread stalls while a block compresses
+
+def encoder(method: int):
+    if method == ZLIB: return lambda block: zlib.compress(block, ZLIB_LEVEL)
+    return lambda block: lzma.compress(block, preset=LZMA_PRESET, check=lzma.CHECK_NONE)
+
+def decoder(method: int):
+    if method == ZLIB: return zlib.decompressobj()
+    return lzma.LZMADecompressor()
+
+def offer(name: str) -> bytes:
+    """OPT_COMPRESS value of a SYN: the method asked for, empty for none."""
+    return bytes([METHODS[name]]) if name in METHODS else b''
+
+def accept(value: bytes) -> int:
+    """Method to answer a SYN's OPT_COMPRESS with: the first offered one this side supports, RAW if none."""
+    return next((method for method in value if method in METHODS.values()), RAW)
+
+class Deflater:
+    """Framed stream of `data` (a buffer), read segment by segment with read().
+
+    `rate()` returns the bytes per second the connection can carry now (0
+    if unknown); the highest rate seen prices the time compression costs
+    against the time the bytes it saves would take to send. Not the current
+    one: stalls while compressing shrink the window and with it the rate,
+    which would make compression look ever more worthwhile.
+    """
+    def __init__(self, data, method: int, rate=lambda: 0):
+        self.data = data;   self.pos = 0    # next file byte to frame
+        self.encode = encoder(method);  self.method = method;   self.rate = rate
+        self.out = b'';     self.start = 0  # framed bytes not read yet: out[start:]
+        self.skip = 0;  self.backoff = 1;   self.peak = 0   # highest rate() seen
+        self.compressed = 0;    self.raw = 0    # blocks sent each way
+        self.framed = 0         # framed bytes produced
+        self.digest = None      # hash object fed every file byte framed
+
+    def read(self, size: int, compress: bool = True):
+        """Next up to `size` framed bytes; b'' at the end, None if compress=False and a block must be framed first."""
+        if len(self.out) - self.start < size and self.pos < len(self.data):
+            if not compress: return None
+            self.fill(size)
+        view = memoryview(self.out)[self.start:self.start + size]
+        self.start += len(view)
+        return view
+
+    def fill(self, size: int):
+        """Frame blocks until `size` bytes are ready or the file is done."""
+        frames = [self.out[self.start:]];   ready = len(frames[0])
+        while ready < size and self.pos < len(self.data):
+            frames.append(self.frame(self.data[self.pos:self.pos + BLOCK]))
+            self.pos += BLOCK;  ready += len(frames[-1])
+        self.out = b''.join(frames);    self.start = 0
+
+    def frame(self, block) -> bytes:
+        payload = block;    method = RAW
+        if self.digest: self.digest.update(block)
+        if self.skip:
+            self.skip -= 1
+        else:
+            cpu = time.thread_time()
+            encoded = self.encode(block)
+            cpu = time.thread_time() - cpu;     saved = len(block) - len(encoded)
+            self.peak = max(self.peak, self.rate())
+            if saved > 0: payload = encoded;    method = self.method
+            if saved >= MIN_SAVING * len(block) and not (self.peak and saved / self.peak < cpu):
+                self.backoff = 1
+            else:   # not worth it: leave the next blocks alone for a while
+                self.skip = self.backoff;   self.backoff = min(2 * self.backoff, MAX_SKIP)
+        if method == RAW: self.raw += 1
+        else: self.compressed += 1
+        self.framed += FRAME.size + len(payload)
+        return FRAME.pack(method, len(payload)) + bytes(payload)
+
+class Inflater:
+    """Undo the framing of in-order stream bytes; feed() returns the file bytes they complete."""
+    def __init__(self):
+        self.head = bytearray();    self.left = 0   # partial frame header, payload bytes of the frame still due
+        self.decoder = None
+
+    def feed(self, data) -> list:
+        out = [];   data = memoryview(data)
+        while data:
+            if not self.left:
+                need = FRAME.size - len(self.head)
+                self.head += data[:need];   data = data[need:]
+                if len(self.head) < FRAME.size: break
+                method, self.left = FRAME.unpack(self.head);    self.head.clear()
+                self.decoder = decoder(method) if method != RAW else None
+                continue
+            chunk = data[:self.left];   data = data[self.left:];    self.left -= len(chunk)
+            out.append(self.decoder.decompress(chunk) if self.decoder else bytes(chunk))
+        return out
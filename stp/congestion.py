@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Congestion controllers shared by the sender and stp.connection."""
+
+import time
+
+class CongestionControl:
+    """Congestion controller interface: cwnd/ssthresh in bytes, driven by ACKs and losses.
+
+    on_ack() gets the bytes newly acknowledged by a cumulative ACK, on_loss()
+    is called on a fast retransmit and on_timeout() on a retransmission
+    timeout, both with the bytes in flight. cwnd never grows past `limit`
+    (the receiver window) since the sender could not use it anyway.
+    """
+    name = ''
+
+    def __init__(self, mss: int, limit: int):
+        self.mss = mss;     self.limit = limit
+        self.cwnd = min(4 * mss, max(2 * mss, 4380))    # RFC 3390 initial window
+        self.ssthresh = limit
+
+    def slow_start(self, acked: int):   # byte counting (RFC 3465) so delayed/stretch ACKs still grow cwnd
+        self.cwnd = min(self.limit, self.cwnd + min(acked, 2 * self.mss))
+
+    def on_ack(self, acked: int):
+        raise NotImplementedError
+
+    def on_loss(self, flight: int):
+        raise NotImplementedError
+
+    def on_timeout(self, flight: int):
+        self.ssthresh = max(flight / 2, 2 * self.mss);  self.cwnd = self.mss
+
+class Reno(CongestionControl):
+    """Slow start and AIMD congestion avoidance (RFC 5681)."""
+    name = 'reno'
+
+    def on_ack(self, acked: int):
+        if self.cwnd < self.ssthresh: return self.slow_start(acked)
+        self.cwnd = min(self.limit, self.cwnd + self.mss * acked / self.cwnd)
+
+    def on_loss(self, flight: int):
+        self.ssthresh = max(flight / 2, 2 * self.mss);  self.cwnd = self.ssthresh
+
+class Cubic(CongestionControl):
+    """CUBIC (RFC 8312): cwnd grows as a cubic of the time since the last loss."""
+    name = 'cubic'
+    C = 0.4;    BETA = 0.7
+
+    def __init__(self, mss: int, limit: int):
+        super().__init__(mss, limit)
+        self.w_max = 0;     self.w_est = 0;     self.k = 0;     self.epoch = None
+
+    def on_ack(self, acked: int):
+        if self.cwnd < self.ssthresh: return self.slow_start(acked)
+        now = time.monotonic()
+        if self.epoch is None:
+            self.epoch = now;   self.w_est = self.cwnd
+            self.k = (max(0, self.w_max - self.cwnd) / self.mss / self.C) ** (1/3)
+        target = self.w_max + self.C * (now - self.epoch - self.k)**3 * self.mss
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * self.mss * acked / self.cwnd   # TCP-friendly region
+        if target > self.cwnd: self.cwnd += (target - self.cwnd) * acked / self.cwnd
+        self.cwnd = min(self.limit, max(self.cwnd, self.w_est))
+
+    def reduce(self):
+        fast_convergence = self.cwnd < self.w_max
+        self.w_max = self.cwnd * (1 + self.BETA) / 2 if fast_convergence else self.cwnd
+        self.ssthresh = max(self.cwnd * self.BETA, 2 * self.mss);     self.epoch = None
+
+    def on_loss(self, flight: int):
+        self.reduce();  self.cwnd = self.ssthresh
+
+    def on_timeout(self, flight: int):
+        self.reduce();  self.cwnd = self.mss
+
+CONGESTION = {cls.name: cls for cls in (Reno, Cubic)}
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""asyncio STP endpoints, for running many transfers inside one process.
+
+open_connection() returns an STPConnection that sends to a receiver,
+start_server() hands every sender that connects to a callback as an
+STPConnection that receives. The wire protocol is the one of
+sender/sender.py and receiver/receiver.py, either end interoperates with
+the command line programs:
+
+    async def handler(conn):
+        with open('out.bin', 'wb') as file:
+            while data := await conn.recv(): file.write(data)
+
+    server = await stp.start_server(handler, '', 50001)
+    conn = await stp.open_connection('127.0.0.1', 50001)
+    await conn.sendfile('in.bin');    await conn.close()
+"""
+
+import asyncio
+import hashlib
+import mmap
+import random
+
+from .congestion import CONGESTION
+from .flight import InFlight, Segment, SendWindow
+from .packet import (DATA, ACK, SYN, FIN, DEFAULT_MSS, MAX_MSS, DIGEST_SIZE, OPT_MSS, OPT_SEQ32, OPT_WINDOW, OPT_CHECKSUM, OPT_RWND,
+                     make_header, parse_packet, intact, pack_options, unpack_options, path_mss)
+from .receive import ReceiveWindow
+from .rto import RtoEstimator
+from .seqnum import SEQ16, SEQ32
+
+DEFAULT_WIN = 1 << 20   # Window of an endpoint that does not ask for another one
+SYN_RETRIES = 6         # SYNs sent before open_connection() gives up
+MSL = 1                 # Maximum segment lifetime, second
+
+class STPConnection(asyncio.DatagramProtocol):
+    """One STP connection: the sending end (open_connection) or the receiving end (start_server).
+
+    send() and sendfile() cut data into segments and wait while the window
+    is full; close() sends the FIN once everything is acknowledged. recv()
+    returns in-order data as it arrives and b'' after the sender's FIN.
+    Unread data counts against the receive window, which the receiving end
+    advertises in its ACKs (OPT_RWND), so a slow reader slows the sender
+    down. With `checksum` (OPT_CHECKSUM) headers carry a CRC32 and the FIN
+    a digest of the data, as with the programs' --checksum=1.
+    """
+    def __init__(self, max_win: int = DEFAULT_WIN, mss: int = DEFAULT_MSS, rto: float = 1.0, cc: str = 'reno',
+                 checksum: bool = False):
+        self.loop = asyncio.get_running_loop()
+        self.transport = None;  self.addr = None    # peer address, None on a connected transport
+        self.max_win = max_win; self.mss = mss;     self.seq = SEQ16
+        self.rtt = RtoEstimator(rto, 0.001);    self.cc_name = cc;  self.cc = None
+        self.checksum = checksum;   self.checked = False    # asked for, negotiated
+        self.digest = None;     self.next_seq = 0   # digest of the data when checked, seqno of the next segment sent
+        self.state = 'CLOSED';  self.error = None
+        self.established = self.loop.create_future();   self.closed = self.loop.create_future()
+        # sending end: the shared InFlight table and SendWindow, one event loop timer per segment
+        self.window = InFlight();   self.flight = None;     self.timers = {}
+        self.room = asyncio.Event()     # set on every ACK, it may have released segments or opened the window
+        # receiving end: the shared ReceiveWindow, unread the bytes recv() did not take yet
+        self.syn = None;    self.syn_ack = b'';     self.rcv = None
+        self.unread = 0;    self.rwnd = False;  self.advertised = None  # window updates negotiated, window of the last ACK
+        self.received = asyncio.Queue()
+
+    #-------------------------asyncio protocol----------------------------#
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.fail(exc or ConnectionError("STP transport closed"))
+
+    def error_received(self, exc):
+        pass    # ICMP errors of earlier sends, the retransmission timers deal with the loss
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 4: return
+        if self.state == 'SYN_SENT':
+            self.on_syn_ack(data)
+        elif self.syn is None and self.state in ('ESTABLISHED', 'FIN_WAIT'):
+            if self.checked and not intact(data, self.seq): return  # corrupted, as if lost
+            self.on_ack(*parse_packet(data, self.seq, self.checked)[1:])
+        elif self.syn is not None:
+            self.on_segment(data)
+
+    #-----------------------------public API------------------------------#
+    async def send(self, data):
+        """Queue `data` for sending, returns once all of it is in the window (not yet acknowledged)."""
+        view = memoryview(data if isinstance(data, (bytes, mmap.mmap)) else bytes(data)).cast('B')
+        i = 0
+        while i < len(view):
+            while self.error is None and not self.can_send(min(self.mss, len(view) - i)):
+                await self.wait_room()
+            if self.error: raise self.error
+            while i < len(view) and self.can_send(min(self.mss, len(view) - i)):   # the whole burst in one go
+                self.send_pkt(DATA, view[i:i+self.mss]);    i += self.mss
+
+    async def sendfile(self, path: str):
+        """Send a file from a memory map, segments are zero-copy slices of it."""
+        with open(path, 'rb') as file:
+            size = file.seek(0, 2)
+            if size: await self.send(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    async def drain(self):
+        """Wait until everything sent so far is acknowledged."""
+        while self.error is None and self.window:
+            self.room.clear();  await self.room.wait()
+        if self.error: raise self.error
+
+    async def recv(self) -> bytes:
+        """Next in-order data, b'' once the sender closed the connection."""
+        if self.error and self.received.empty(): raise self.error
+        data = await self.received.get()
+        if not data and self.error: raise self.error
+        self.unread -= len(data)
+        if self.rwnd and self.advertised is not None and self.state == 'ESTABLISHED' and self.advertised < self.max_win // 2 <= self.free():
+            self.send_ack()     # window update: the last ACK may have left the sender waiting, half the window is open again
+        return data
+
+    async def close(self):
+        """Sending end: FIN after all data is acknowledged, then wait for its ACK."""
+        if self.syn is None and self.state == 'ESTABLISHED':
+            await self.drain()
+            self.state = 'FIN_WAIT';    self.send_pkt(FIN, self.digest.digest() if self.digest else b'')
+            await self.drain()
+        self.end()
+
+    def end(self):
+        self.state = 'CLOSED'
+        if self.syn is None and self.transport: self.transport.close()
+        if not self.closed.done(): self.closed.set_result(None)
+
+    async def wait_closed(self):
+        await asyncio.shield(self.closed)
+
+    #-----------------------------sending end-----------------------------#
+    async def connect(self):
+        isn = random.randrange(SEQ32.mod);  seqno = isn % SEQ16.mod    # the SYN header is always 16 bit
+        sock = self.transport.get_extra_info('socket')
+        self.mss = min(self.mss or path_mss(sock), self.max_win)
+        options = {OPT_MSS: self.mss.to_bytes(2, 'big')}
+        if self.max_win >= SEQ16.half: options[OPT_SEQ32] = SEQ32.pack(isn)    # window needs 32-bit seqnos
+        if self.checksum: options[OPT_CHECKSUM] = b''
+        options[OPT_RWND] = b''
+        syn = make_header(SEQ16, SYN, seqno) + pack_options(options)
+        self.state = 'SYN_SENT';    self.isn = isn;     self.next_seq = SEQ16.add(seqno, 1)
+        for tries in range(SYN_RETRIES):
+            sent = self.loop.time();    self.transport.sendto(syn, self.addr)
+            try:
+                await asyncio.wait_for(asyncio.shield(self.established), self.rtt.rto)
+            except asyncio.TimeoutError:
+                self.rtt.backoff();     continue
+            if not tries: self.rtt.sample(self.loop.time() - sent)    # Karn's algorithm
+            return
+        self.fail(ConnectionError("STP connection timed out"))
+        raise self.error
+
+    def on_syn_ack(self, data: bytes):
+        type, seqno, payload = parse_packet(data)
+        if type != ACK or seqno != self.next_seq: return
+        options = unpack_options(payload)   # a receiver without options takes DEFAULT_MSS
+        if OPT_SEQ32 in options:
+            self.seq = SEQ32;   self.next_seq = SEQ32.add(self.isn, 1)
+        peer_win = int.from_bytes(options.get(OPT_WINDOW, b''), 'big') or self.max_win
+        self.max_win = min(self.max_win, peer_win, self.seq.half - 1)
+        peer_mss = int.from_bytes(options.get(OPT_MSS, DEFAULT_MSS.to_bytes(2, 'big')), 'big')
+        self.mss = min(self.mss, peer_mss, self.max_win)
+        self.checked = OPT_CHECKSUM in options  # from here on every header carries a CRC32
+        if self.checked: self.digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        self.cc = CONGESTION[self.cc_name](self.mss, self.max_win)
+        self.flight = SendWindow(self.window, self.seq, self.max_win, self.rtt, self.cc, self.loop.time,
+                                 self.resend_pkt, self.cancel_timer, rwnd=OPT_RWND in options)
+        self.state = 'ESTABLISHED';     self.established.set_result(None)
+
+    def can_send(self, size: int) -> bool:
+        return self.flight.can_send(size)
+
+    async def wait_room(self):
+        """Until the next ACK; a receiver window that stays shut with nothing in flight is probed every RTO."""
+        self.room.clear()
+        if not self.flight.shut():  # an ACK is due, it sets room
+            await self.room.wait();     return
+        try:
+            await asyncio.wait_for(self.room.wait(), self.rtt.rto)
+        except asyncio.TimeoutError:    # an empty segment at the next seqno, answered with the current window
+            self.transport.sendto(make_header(self.seq, DATA, self.next_seq, b'' if self.checked else None), self.addr)
+
+    def send_pkt(self, type: int, data=b''):
+        hdr = make_header(self.seq, type, self.next_seq, data if self.checked else None)
+        self.transport.sendto(hdr + data, self.addr)
+        if self.digest and type == DATA: self.digest.update(data)
+        end = self.seq.add(self.next_seq, len(data) if type == DATA else 1)
+        segment = Segment(type, self.next_seq, end, hdr, data, self.loop.time())
+        self.window.append(segment);    self.arm(segment)
+        self.next_seq = end
+
+    def resend_pkt(self, segment: Segment):
+        self.transport.sendto(segment.hdr + segment.data, self.addr)
+        segment.sent_at = self.loop.time();     segment.retx += 1
+        self.arm(segment)
+
+    def arm(self, segment: Segment):
+        self.cancel_timer(segment)
+        self.timers[segment.end] = self.loop.call_later(self.rtt.rto, self.on_timeout, segment.end)
+
+    def cancel_timer(self, segment: Segment):
+        timer = self.timers.pop(segment.end, None)
+        if timer: timer.cancel()
+
+    def on_timeout(self, end: int):
+        self.timers.pop(end, None)
+        self.flight.on_timeout(end)
+
+    def on_ack(self, seqno: int, payload):
+        self.flight.on_ack(seqno, payload)
+        self.room.set()
+
+    def fail(self, exc: Exception):
+        if self.closed.done(): return
+        self.error = exc
+        if self.syn is None:
+            for timer in self.timers.values(): timer.cancel()
+            self.timers.clear()
+        self.room.set();    self.received.put_nowait(b'')
+        self.end()
+
+    #----------------------------receiving end----------------------------#
+    def accept(self, syn: bytes):
+        """Answer a sender's SYN, negotiating MSS, window and sequence space."""
+        _, seqno, payload = parse_packet(syn)
+        options = unpack_options(payload)   # a sender without options uses DEFAULT_MSS
+        peer_mss = int.from_bytes(options.get(OPT_MSS, DEFAULT_MSS.to_bytes(2, 'big')), 'big')
+        accepted = {OPT_SEQ32: b''} if OPT_SEQ32 in options else {}
+        self.max_win = min(self.max_win, (SEQ32 if accepted else SEQ16).half - 1)
+        self.mss = min(self.mss, self.max_win, peer_mss)
+        if OPT_CHECKSUM in options: accepted[OPT_CHECKSUM] = b''
+        if OPT_RWND in options: accepted[OPT_RWND] = b''    # the room recv() leaves is advertised
+        self.syn = syn;     self.syn_ack = pack_options({OPT_MSS: self.mss.to_bytes(2, 'big'),
+                                                         OPT_WINDOW: self.max_win.to_bytes(4, 'big'), **accepted})
+        self.reply_ACK(SEQ16.add(seqno, 1), self.syn_ack, SEQ16)
+        next_seq = SEQ16.add(seqno, 1)
+        if OPT_SEQ32 in accepted:   # from here on every header carries 32-bit seqnos
+            self.seq = SEQ32;   next_seq = SEQ32.add(SEQ32.unpack(options[OPT_SEQ32]), 1)
+        self.checked = OPT_CHECKSUM in accepted     # ... and a CRC32, the FIN a digest of the data
+        if self.checked: self.digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        self.rwnd = OPT_RWND in accepted
+        self.rcv = ReceiveWindow(self.seq, next_seq, self.max_win, self.deliver)
+        self.state = 'ESTABLISHED';     self.established.set_result(None)
+
+    def on_segment(self, data: bytes):
+        if int.from_bytes(data[:2], 'big') == SYN:  # our SYN ACK was lost, answer the same way again
+            self.reply_ACK(SEQ16.add(SEQ16.unpack(data, 2), 1), self.syn_ack, SEQ16)
+            return
+        if self.checked and not intact(data, self.seq): return  # corrupted on the way, the sender resends it
+        type, seqno, payload = parse_packet(data, self.seq, self.checked)
+        if type == FIN:
+            self.reply_ACK(self.seq.add(seqno, 1))
+            if self.state == 'ESTABLISHED':     # TIME_WAIT only answers FIN retransmissions
+                if self.digest and self.digest.digest() != bytes(payload):
+                    self.error = ConnectionError("STP digest mismatch, the data received is corrupted")
+                self.state = 'TIME_WAIT';   self.received.put_nowait(b'')
+                self.loop.call_later(2*MSL, self.end)
+            return
+        if type != DATA or self.state != 'ESTABLISHED': return
+        self.rcv.on_data(seqno, payload, self.free())
+        self.send_ack()
+
+    def free(self) -> int:
+        """Receive window past next_seq: max_win less what recv() did not take. Out-of-order bytes lie
+        inside it and do not shrink it, or every duplicate ACK would look like a window update."""
+        return max(0, self.max_win - self.unread)
+
+    def deliver(self, data):
+        data = bytes(data)  # ring views are reused by the next held segment
+        self.unread += len(data)
+        if self.digest: self.digest.update(data)
+        self.received.put_nowait(data)
+
+    def send_ack(self):
+        if self.rwnd: self.advertised = self.free()
+        self.reply_ACK(self.rcv.next_seq, self.rcv.ack_payload(self.advertised if self.rwnd else None))
+
+    def reply_ACK(self, seqno: int, payload=b'', space=None):
+        checked = self.checked and space is None    # the SYN ACK never carries a checksum
+        self.transport.sendto(make_header(space or self.seq, ACK, seqno, payload if checked else None) + payload, self.addr)
+
+class STPServer(asyncio.DatagramProtocol):
+    """Receiving socket of start_server(): one STPConnection per sender address.
+
+    A SYN that differs from the one a connection was opened with starts a
+    new incarnation on that address; a connection is forgotten when its
+    TIME_WAIT ends.
+    """
+    def __init__(self, client_connected_cb, max_win: int, mss: int):
+        self.loop = asyncio.get_running_loop()
+        self.client_connected_cb = client_connected_cb
+        self.max_win = max_win; self.mss = mss
+        self.transport = None;  self.conns = {}
+        self.closed = self.loop.create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        for conn in self.conns.values(): conn.fail(exc or ConnectionError("STP server closed"))
+        if not self.closed.done(): self.closed.set_result(None)
+
+    def error_received(self, exc):
+        pass
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 4: return
+        conn = self.conns.get(addr)
+        if int.from_bytes(data[:2], 'big') == SYN and (conn is None or conn.syn != data):
+            if conn: conn.fail(ConnectionError("STP connection restarted by the peer"))
+            conn = self.conns[addr] = STPConnection(self.max_win, self.mss)
+            conn.transport = self.transport;    conn.addr = addr
+            conn.closed.add_done_callback(lambda _: self.forget(addr, conn))
+            conn.accept(data)
+            result = self.client_connected_cb(conn)
+            if asyncio.iscoroutine(result): self.loop.create_task(result)
+        elif conn is not None:
+            conn.datagram_received(data, addr)
+
+    def forget(self, addr, conn):
+        if self.conns.get(addr) is conn: del self.conns[addr]
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await asyncio.shield(self.closed)
+
+    async def serve_forever(self):
+        await self.wait_closed()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close();   await self.wait_closed()
+
+async def open_connection(host: str, port: int, *, local_addr=None, max_win: int = DEFAULT_WIN,
+                          mss: int = DEFAULT_MSS, rto: float = 1.0, cc: str = 'reno', checksum: bool = False) -> STPConnection:
+    """Connect to a receiver, `mss=0` takes it from the path MTU; `checksum` asks for checksummed headers."""
+    if cc not in CONGESTION: raise ValueError(f"unknown congestion control {cc!r}")
+    loop = asyncio.get_running_loop()
+    _, conn = await loop.create_datagram_endpoint(lambda: STPConnection(max_win, mss, rto, cc, checksum),
+                                                  remote_addr=(host, port), local_addr=local_addr)
+    try:
+        await conn.connect()
+    except BaseException:
+        conn.transport.close();     raise
+    return conn
+
+async def start_server(client_connected_cb, host: str, port: int, *, max_win: int = DEFAULT_WIN,
+                       mss: int = MAX_MSS) -> STPServer:
+    """Receive from any number of senders on one socket, `host=''` listens on all addresses.
+
+    `client_connected_cb(conn)` is called with the STPConnection of every new
+    sender and may be a coroutine function.
+    """
+    loop = asyncio.get_running_loop()
+    _, server = await loop.create_datagram_endpoint(lambda: STPServer(client_connected_cb, max_win, mss),
+                                                    local_addr=(host or '0.0.0.0', port))
+    return server
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Network emulator: a UDP proxy that impairs the traffic between sender and receiver.
+
+    python -m stp.emulator listen_port receiver_port [--option=value ...]
+
+The sender sends to listen_port; the emulator forwards every datagram to
+receiver_port from its own socket (bound to --source-port, which is the
+receiver's sender_port) and carries the ACKs back the same way. Each
+direction is a Link that applies, in this order, loss, a bottleneck of
+--rate bytes/s with a --queue byte tail-drop queue, --delay plus up to
+--jitter ms, and reordering (--reorder of the datagrams are held back
+another --reorder-delay ms). --corrupt of the datagrams that get through
+have one random bit flipped.
+
+Every random choice comes from a generator seeded with --seed, one per
+direction, so the same seed drops the same datagrams of the same traffic.
+"""
+
+import heapq
+import itertools
+import random
+import select
+import socket
+import sys
+import threading
+import time
+from dataclasses import dataclass, fields
+
+from .cli import parse_opts
+
+class Loss:
+    """Datagram loss: uniform with probability `rate`, or Gilbert-Elliott bursts.
+
+    The spec is a probability (`0.02`) or `ge:P_GB:P_BG[:LOSS_BAD[:LOSS_GOOD]]`:
+    the link moves from the good to the bad state with P_GB and back with
+    P_BG per datagram, and loses LOSS_BAD (default 1) of the datagrams in
+    the bad state and LOSS_GOOD (default 0) in the good one.
+    """
+    def __init__(self, spec: str, rng: random.Random):
+        self.rng = rng;     self.bad = False
+        if spec.startswith('ge:'):
+            values = [float(v) for v in spec[3:].split(':')]
+            if not 2 <= len(values) <= 4: raise ValueError(f"invalid Gilbert-Elliott loss {spec!r}")
+            self.p_gb, self.p_bg, self.loss_bad, self.loss_good = values + [1.0, 0.0][len(values) - 2:]
+        else:
+            self.p_gb = 0.0;    self.p_bg = 1.0;    self.loss_bad = 0.0;    self.loss_good = float(spec)
+        for p in (self.p_gb, self.p_bg, self.loss_bad, self.loss_good):
+            if not 0 <= p <= 1: raise ValueError(f"invalid loss {spec!r}, probabilities must be within [0, 1]")
+
+    def lost(self) -> bool:
+        if self.p_gb: self.bad = self.rng.random() >= self.p_bg if self.bad else self.rng.random() < self.p_gb
+        return self.rng.random() < (self.loss_bad if self.bad else self.loss_good)
+
+class Link:
+    """One direction of the emulated path; admit() returns a datagram's release time or None if it is dropped."""
+    def __init__(self, loss: str = '0', delay: float = 0, jitter: float = 0, reorder: float = 0,
+                 reorder_delay: float = 0.01, rate: float = 0, queue: int = 64 * 1024, corrupt: float = 0, seed=None):
+        self.rng = random.Random(seed);     self.loss = Loss(loss, self.rng)
+        self.delay = delay;     self.jitter = jitter    # seconds
+        self.reorder = reorder; self.reorder_delay = reorder_delay
+        self.rate = rate;   self.queue = queue;     self.link_free = 0.0    # time the bottleneck is idle again
+        self.corrupt = corrupt
+        self.passed = 0;    self.lost = 0;  self.overflow = 0;  self.corrupted = 0
+
+    def admit(self, now: float, size: int):
+        if self.loss.lost():
+            self.lost += 1;     return None
+        at = now
+        if self.rate:
+            backlog = max(0.0, self.link_free - now) * self.rate
+            if backlog + size > self.queue:
+                self.overflow += 1;     return None
+            at = self.link_free = max(now, self.link_free) + size / self.rate
+        at += self.delay + self.rng.uniform(0, self.jitter)
+        if self.reorder and self.rng.random() < self.reorder: at += self.reorder_delay
+        self.passed += 1
+        return at
+
+    def mangle(self, data: bytes) -> bytes:
+        """`data`, with one bit flipped for a `corrupt` share of the datagrams."""
+        if not (self.corrupt and data and self.rng.random() < self.corrupt): return data
+        bit = self.rng.randrange(8 * len(data));    data = bytearray(data)
+        data[bit // 8] ^= 1 << bit % 8;     self.corrupted += 1
+        return bytes(data)
+
+class Emulator(threading.Thread):
+    """UDP proxy applying `forward` to sender->receiver datagrams and `backward` to the ACKs.
+
+    Every sender address gets its own upstream socket, the first one bound
+    to `source_port`, so several senders can share one emulator.
+    """
+    def __init__(self, listen_port: int, target: tuple, forward: Link, backward: Link, source_port: int = 0):
+        super().__init__(daemon=True)
+        self.target = target;   self.source_port = source_port
+        self.forward = forward; self.backward = backward
+        self.down = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.down.bind(('', listen_port));  self.down.setblocking(False)
+        self.upstream = {};     self.clients = {}   # sender address -> upstream socket, and back
+        self.queue = [];    self.ticket = itertools.count()     # heap of (release, n, socket, datagram, address)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            timeout = max(0.0, self.queue[0][0] - time.monotonic()) if self.queue else 0.1
+            readable = select.select([self.down, *self.clients], [], [], min(timeout, 0.1))[0]
+            now = time.monotonic()
+            for sock in readable:
+                while True:
+                    try:
+                        data, addr = sock.recvfrom(65535)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except ConnectionRefusedError:  # ICMP error of an earlier send
+                        continue
+                    if sock is self.down:
+                        link = self.forward;    out = self.upstream_for(addr);  addr = self.target
+                    else:
+                        link = self.backward;   out = self.down;    addr = self.clients[sock]
+                    release = link.admit(now, len(data))
+                    if release is not None: heapq.heappush(self.queue, (release, next(self.ticket), out, link.mangle(data), addr))
+            while self.queue and self.queue[0][0] <= time.monotonic():
+                _, _, out, data, addr = heapq.heappop(self.queue)
+                try:
+                    out.sendto(data, addr)
+                except OSError:
+                    pass    # a full or refused path is just another loss
+
+    def upstream_for(self, addr):
+        if addr not in self.upstream:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(('', 0 if self.upstream else self.source_port));  sock.setblocking(False)
+            self.upstream[addr] = sock;     self.clients[sock] = addr
+        return self.upstream[addr]
+
+    def stop(self):
+        self.stopped.set();     self.join()
+        for sock in (self.down, *self.clients): sock.close()
+
+@dataclass
+class Control:
+    """Control block: parameters for the emulator program."""
+    listen_port: int
+    receiver_port: int
+    host: str = '127.0.0.1' # --host: receiver address
+    source_port: int = 0    # --source-port: port the receiver sees, its sender_port
+    loss: str = '0';    ack_loss: str = ''  # --loss / --ack-loss: see Loss, ack-loss defaults to loss
+    delay: float = 0;   jitter: float = 0   # --delay / --jitter: ms each way
+    reorder: float = 0;     reorder_delay: float = 10   # --reorder: share of datagrams held back reorder-delay ms
+    rate: float = 0;    queue: int = 64 * 1024  # --rate: bottleneck bytes/s each way (0 = unlimited), --queue: its bytes
+    corrupt: float = 0      # --corrupt: share of datagrams with a bit flipped, each way
+    seed: int = 0           # --seed: seeds both directions' generators
+
+def links(control: Control) -> tuple:
+    """Forward and backward Link of a Control block."""
+    common = dict(delay=control.delay / 1000, jitter=control.jitter / 1000, reorder=control.reorder,
+                  reorder_delay=control.reorder_delay / 1000, rate=control.rate, queue=control.queue,
+                  corrupt=control.corrupt)
+    return (Link(control.loss, seed=f"{control.seed}/forward", **common),
+            Link(control.ack_loss or control.loss, seed=f"{control.seed}/backward", **common))
+
+def main():
+    if len(sys.argv) < 3:
+        sys.exit(f"Usage: python -m stp.emulator listen_port receiver_port [--option=value ...]")
+    try:
+        control = Control(int(sys.argv[1]), int(sys.argv[2]))
+        parse_opts(control, sys.argv[3:], [f.name for f in fields(control)][2:])   # all but the ports
+        forward, backward = links(control)
+    except ValueError as e:
+        sys.exit(f"Invalid argument! {e}")
+    emulator = Emulator(control.listen_port, (control.host, control.receiver_port), forward, backward, control.source_port)
+    emulator.start()
+    try:
+        while emulator.is_alive(): emulator.join(0.5)
+    except KeyboardInterrupt:
+        emulator.stop()
+    for name, link in (('forward', forward), ('backward', backward)):
+        print(f"{name}: passed {link.passed}, lost {link.lost}, queue overflow {link.overflow}, corrupted {link.corrupted}")
+
+if __name__ == "__main__":
+    main()
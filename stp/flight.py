@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""The sending end of STP, shared by sender/sender.py and stp.connection.
+
+InFlight holds the segments sent and not acknowledged yet; SendWindow
+decides how much more may be sent and processes what comes back: it
+releases acknowledged segments, marks SACKed ones, runs fast retransmit
+and NewReno-style recovery and handles retransmission timeouts. The
+transport stays with the owner, which passes it in as callbacks: the
+sender program drives a SendWindow from its listener and timer wheel
+threads under window_cv, an STPConnection from its event loop.
+"""
+
+from .packet import DATA, RWND, unpack_sack
+
+DUP_THRESH = 3          # duplicate ACKs that trigger a fast retransmit
+
+class Segment:
+    """One in-flight segment, known by `end`: the seqno of the ACK that acknowledges it."""
+    __slots__ = ('type', 'seqno', 'end', 'hdr', 'data', 'length', 'sent_at', 'retx', 'sacked')
+
+    def __init__(self, type: int, seqno: int, end: int, hdr: bytes, data, sent_at: float):
+        self.type = type;   self.seqno = seqno;     self.end = end
+        self.hdr = hdr;     self.data = data    # header and payload view, resent as they are
+        self.length = len(data) if type == DATA else 0  # window bytes it takes
+        self.sent_at = sent_at;     self.retx = 0;  self.sacked = False
+
+class InFlight:
+    """Segments sent and not acknowledged yet, oldest first, in a growable ring.
+
+    Segments are appended in seqno order, so the oldest is the ring's head
+    and a cumulative ACK releases from there; `index` finds a segment by its
+    `end`. `bytes` is the DATA payload in flight.
+    """
+    def __init__(self, size: int = 64):
+        self.ring = [None] * size;  self.head = 0;  self.count = 0
+        self.index = {};    self.bytes = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        ring = self.ring;   size = len(ring)
+        for i in range(self.head, self.head + self.count): yield ring[i % size]
+
+    def get(self, end: int):
+        return self.index.get(end)
+
+    def oldest(self) -> Segment:
+        return self.ring[self.head]
+
+    def newest(self) -> Segment:
+        return self.ring[(self.head + self.count - 1) % len(self.ring)]
+
+    def append(self, segment: Segment):
+        if self.count == len(self.ring):    # full: double it, the oldest moves to slot 0
+            self.ring = [*self, *[None] * self.count];  self.head = 0
+        self.ring[(self.head + self.count) % len(self.ring)] = segment
+        self.count += 1;    self.index[segment.end] = segment;  self.bytes += segment.length
+
+    def release(self, end: int) -> list:
+        """Remove the segments up to and including the one acknowledged by `end` (it must be in flight)."""
+        released = [];  ring = self.ring
+        while True:
+            segment = ring[self.head];  ring[self.head] = None
+            self.head = (self.head + 1) % len(ring);    self.count -= 1
+            del self.index[segment.end];    self.bytes -= segment.length
+            released.append(segment)
+            if segment.end == end: return released
+
+class SendWindow:
+    """Window and loss recovery of one sending end, over the InFlight table `window`.
+
+    `rtt` is the RtoEstimator, `cc` the congestion controller, `clock()` the
+    time. `resend(segment)` retransmits a segment and re-arms its timer,
+    `cancel(segment)` stops its timer; `sample(r)` takes every valid RTT
+    sample (Karn's algorithm, rtt.sample by default) and `on_cwnd()` is called
+    whenever cc changed. With `rwnd` (OPT_RWND negotiated) every ACK may
+    carry the receiver's free window in front of its SACK blocks. The owner
+    serialises the calls. The counters are kept for logs and metrics.
+    """
+    def __init__(self, window: InFlight, seq, max_win: int, rtt, cc, clock, resend, cancel,
+                 sample=None, on_cwnd=None, rwnd: bool = False):
+        self.window = window;   self.seq = seq;     self.max_win = max_win
+        self.rtt = rtt;     self.cc = cc;   self.clock = clock
+        self.resend = resend;   self.cancel = cancel
+        self.sample = sample or rtt.sample;     self.on_cwnd = on_cwnd or (lambda: None)
+        self.rwnd = max_win if rwnd else None   # receiver's free window of its last ACK
+        self.dup_cnt = 0;   self.last_ack = None
+        self.recover = None;    self.rexmit = set()     # recovery point, holes already resent in this recovery
+        self.acked = 0;     self.dup_acks = 0;  self.fast_retx = 0;     self.timeouts = 0
+
+    def room(self) -> int:
+        """Bytes that may still be sent: the congestion and receiver windows less what is in flight."""
+        limit = self.max_win if self.rwnd is None else min(self.max_win, self.rwnd)
+        return min(self.cc.cwnd, limit) - self.window.bytes
+
+    def can_send(self, size: int) -> bool:
+        return self.room() >= size
+
+    def shut(self) -> bool:
+        """Nothing in flight whose ACK could reopen a closed receiver window: time for a window probe."""
+        return self.rwnd is not None and not self.window
+
+    def on_ack(self, seqno: int, payload) -> list:
+        """Process one ACK; returns the segments it released, oldest first."""
+        window = self.window;   last_rwnd = self.rwnd;  released = []
+        if self.rwnd is not None and len(payload) >= RWND:  # a repeated SYN ACK's options read as a window beyond max_win: no harm
+            self.rwnd = int.from_bytes(payload[:RWND], 'big');  payload = payload[RWND:]
+        sacked = self.mark_sacked(payload)
+        segment = window.get(seqno)
+        if segment is not None:     # new cumulative ACK
+            if not segment.retx: self.sample(self.clock() - segment.sent_at)   # Karn's algorithm
+            released = window.release(seqno);   acked = 0
+            for segment in released:
+                self.cancel(segment);   acked += segment.length
+            self.acked += acked
+            if self.recover is None:
+                self.cc.on_ack(acked);  self.on_cwnd()
+            self.dup_cnt = 0
+            if self.recover is not None and window.get(self.recover) is None:
+                self.recover = None;    self.rexmit.clear()     # full ACK ends recovery
+            elif self.recover is not None:
+                self.fast_retransmit(window.oldest().end)       # partial ACK: next hole lost too
+        elif seqno == self.last_ack and window and (sacked or self.rwnd == last_rwnd):    # not just a window update
+            self.dup_acks += 1;     self.dup_cnt += 1
+            if self.dup_cnt == DUP_THRESH and self.recover is None:
+                self.recover = window.newest().end
+                self.cc.on_loss(window.bytes);  self.on_cwnd()
+                self.fast_retransmit(window.oldest().end)
+            elif self.recover is not None:
+                self.fast_retransmit(self.next_hole())
+        self.last_ack = seqno
+        return released
+
+    def on_timeout(self, end: int) -> bool:
+        """Deadline of a segment expired: resend it; False if it was acknowledged or SACKed meanwhile."""
+        segment = self.window.get(end)
+        if segment is None or segment.sacked: return False
+        if segment is self.window.oldest():     # back off once per loss, not per segment
+            self.rtt.backoff();     self.cc.on_timeout(self.window.bytes);  self.on_cwnd()
+        self.timeouts += 1
+        self.resend(segment)
+        return True
+
+    def mark_sacked(self, sack) -> int: #Flag in-flight segments covered by the ACK's SACK blocks, stop their timers; returns how many were new
+        seq = self.seq;     window = self.window;   marked = 0
+        blocks = unpack_sack(seq, sack)
+        if not blocks or not window: return 0
+        first = window.oldest().seqno;  last = window.newest().end
+        flight = seq.diff(last, first)  # blocks outside it are stale, e.g. options of a repeated SYN ACK
+        blocks = [(left, right) for left, right in blocks if seq.diff(left, first) < flight and 0 < seq.diff(right, left) <= seq.diff(last, left)]
+        for segment in window:
+            for left, right in blocks:
+                span = seq.diff(right, left)
+                if seq.diff(segment.seqno, left) < span and seq.diff(segment.end, left) <= span:
+                    if not segment.sacked:
+                        segment.sacked = True;  self.cancel(segment);   marked += 1
+                    break
+        return marked
+
+    def next_hole(self): #Oldest un-SACKed segment below a SACKed one that was not resent yet
+        hole = None
+        for segment in self.window:
+            if segment.sacked and hole is not None: return hole
+            if not segment.sacked and hole is None and segment.end not in self.rexmit: hole = segment.end
+        return None
+
+    def fast_retransmit(self, end):
+        if end is None or end in self.rexmit or self.window.get(end).sacked: return
+        self.rexmit.add(end);   self.fast_retx += 1
+        self.resend(self.window.get(end))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Packet logs written off the hot path.
+
+A log call only appends a record to an in-memory ring (a bounded deque);
+one background thread drains every open log, formats the records and
+writes them in batches. Every batch is flushed to the file, so a process
+that is killed or hangs loses at most FLUSH_INTERVAL of records. Records
+are dropped, and counted, rather than blocking the caller when the
+writer falls behind.
+
+The binary format stores each record as a fixed-size struct; decode it
+to the text layout with `python -m stp.log FILE`.
+"""
+
+import collections
+import os
+import struct
+import sys
+import threading
+import time
+
+OFF = 0;    SUMMARY = 1;    PACKET = 2
+LEVELS = {'off': OFF, 'summary': SUMMARY, 'packet': PACKET}
+KINDS = ('snd', 'rcv', 'drp');  TYPES = ('DATA', 'ACK', 'SYN', 'FIN')
+KIND_CODE = {kind: i for i, kind in enumerate(KINDS)}
+TYPE_CODE = {type: i for i, type in enumerate(TYPES)}
+TEXT = 0xff     # record kind of a summary line, `length` bytes of UTF-8 follow
+
+MAGIC = b'STPLOG1\n'
+START = struct.Struct('<d')             # wall clock time of the log's start
+RECORD = struct.Struct('<dBBIH')        # seconds since start, kind, type, seqno, length
+CAPACITY = 1 << 16      # records a log buffers before it drops
+FLUSH_INTERVAL = 0.05   # seconds between two drains of the writer thread
+
+def text_record(ms: float, kind: str, type: str, seqno: int, length: int) -> str:
+    return f"{kind}\t %7.2f\t\t {type}\t {seqno}\t {length}\n" %ms
+
+def log_path(name: str, binary: bool) -> str:
+    """File name of a log: binary logs swap the extension for .bin."""
+    return os.path.splitext(name)[0] + '.bin' if binary else name
+
+class PacketLog:
+    """One log file: packet records at level PACKET, summary lines from level SUMMARY.
+
+    packet() and summary() may be called from any thread; the records reach
+    the file in call order.
+    """
+    def __init__(self, name: str, level: int = PACKET, binary: bool = False, capacity: int = CAPACITY):
+        self.level = level;     self.binary = binary;   self.capacity = capacity
+        self.start = time.time();   self.dropped = 0
+        self.records = collections.deque();     self.file = None
+        self.lock = threading.Lock()    # one drain at a time: writer thread or close()
+        if level > OFF:
+            self.file = open(log_path(name, binary), 'wb' if binary else 'w')
+            if binary: self.file.write(MAGIC + START.pack(self.start))
+            writer().add(self)
+
+    def packet(self, kind: str, type: str, seqno: int, length: int):
+        if self.level < PACKET: return
+        if len(self.records) >= self.capacity:
+            self.dropped += 1;  return
+        self.records.append((time.time(), kind, type, seqno, length))
+
+    def summary(self, text: str):
+        if self.level >= SUMMARY: self.records.append((time.time(), None, text, 0, 0))
+
+    def flush(self):
+        with self.lock:
+            if self.file is None or not self.records: return
+            format = self.pack if self.binary else self.format
+            batch = [format(self.records.popleft()) for _ in range(len(self.records))]
+            self.file.write((b'' if self.binary else '').join(batch))
+            self.file.flush()   # on disk for a process that is killed or hangs, when the log matters most
+
+    def format(self, record) -> str:
+        at, kind, type, seqno, length = record
+        if kind is None: return type
+        return text_record((at - self.start)*1000, kind, type, seqno, length)
+
+    def pack(self, record) -> bytes:
+        at, kind, type, seqno, length = record
+        if kind is None:
+            text = type.encode();   return RECORD.pack(at - self.start, TEXT, 0, 0, len(text)) + text
+        return RECORD.pack(at - self.start, KIND_CODE[kind], TYPE_CODE[type], seqno, length)
+
+    def close(self):
+        if self.file is None: return
+        writer().remove(self)
+        if self.dropped: self.summary(f"Log records dropped:\t\t{self.dropped}\n")
+        self.flush()
+        with self.lock:
+            self.file.close();  self.file = None
+
+class LogWriter(threading.Thread):
+    """Background thread draining every open PacketLog each FLUSH_INTERVAL."""
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.logs = set();  self.logs_lock = threading.Lock()
+
+    def add(self, log: PacketLog):
+        with self.logs_lock: self.logs.add(log)
+
+    def remove(self, log: PacketLog):
+        with self.logs_lock: self.logs.discard(log)
+
+    def run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            with self.logs_lock: logs = list(self.logs)
+            for log in logs: log.flush()
+
+_writer = None
+def writer() -> LogWriter:
+    """The process' writer thread, started on first use (again in a forked child)."""
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        _writer = LogWriter();  _writer.start()
+    return _writer
+
+def decode(name: str, out=sys.stdout):
+    """Write a binary log in the text layout."""
+    with open(name, 'rb') as file: buf = file.read()
+    if not buf.startswith(MAGIC): sys.exit(f"{name}: not a binary STP log")
+    i = len(MAGIC) + START.size
+    while i + RECORD.size <= len(buf):
+        at, kind, type, seqno, length = RECORD.unpack_from(buf, i);  i += RECORD.size
+        if kind == TEXT:
+            out.write(buf[i:i + length].decode());     i += length
+        else:
+            out.write(text_record(at*1000, KINDS[kind], TYPES[type], seqno, length))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2: sys.exit(f"Usage: python -m stp.log FILE.bin")
+    decode(sys.argv[1])
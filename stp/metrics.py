@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Live metrics of a running transfer.
+
+A Registry only holds functions that read the program's own counters and
+gauges when a snapshot is taken, so the hot path pays nothing for them;
+histograms are the one thing updated per event. A Reporter thread
+publishes snapshots as JSON to clients of a local TCP port (one snapshot
+per connection, `nc 127.0.0.1 PORT`) and/or by rewriting a file every
+interval.
+"""
+
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+class Histogram:
+    """Power-of-two histogram of durations: bucket i holds values up to 2**i microseconds."""
+    def __init__(self):
+        self.buckets = [0] * 32
+        self.count = 0;     self.total = 0.0
+        self.min = None;    self.max = None
+
+    def add(self, seconds: float):
+        us = int(seconds * 1e6)
+        self.buckets[min(31, us.bit_length())] += 1
+        self.count += 1;    self.total += seconds
+        if self.min is None or seconds < self.min: self.min = seconds
+        if self.max is None or seconds > self.max: self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile."""
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= q * self.count: return 2**i / 1e6
+        return self.max
+
+    def snapshot(self) -> dict:
+        if not self.count: return {'count': 0}
+        return {'count': self.count, 'mean': self.total / self.count, 'min': self.min, 'max': self.max,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+                'buckets': {f"{2**i / 1e6:g}": n for i, n in enumerate(self.buckets) if n}}
+
+class Registry:
+    """Named metrics of one program, see snapshot() for the layout.
+
+    counter() and gauge() take a function returning the current value;
+    rate() turns a cumulative reading into units per second, both since the
+    previous snapshot and since the start.
+    """
+    def __init__(self):
+        self.start = time.monotonic()
+        self.counters = {};     self.gauges = {};   self.rates = {};    self.histograms = {}
+        self.last = {};     self.lock = threading.Lock()    # previous (time, value) of every rate
+
+    def counter(self, name: str, read):
+        self.counters[name] = read
+
+    def gauge(self, name: str, read):
+        self.gauges[name] = read
+
+    def rate(self, name: str, read):
+        self.rates[name] = read
+
+    def histogram(self, name: str) -> Histogram:
+        return self.histograms.setdefault(name, Histogram())
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            now = time.monotonic();     elapsed = now - self.start
+            rates = {}
+            for name, read in self.rates.items():
+                value = read();     then, before = self.last.get(name, (self.start, 0))
+                rates[name] = {'current': (value - before) / (now - then) if now > then else 0.0,
+                               'average': value / elapsed if elapsed else 0.0}
+                self.last[name] = (now, value)
+            return {'time': elapsed,
+                    'counters': {name: read() for name, read in self.counters.items()},
+                    'gauges': {name: read() for name, read in self.gauges.items()},
+                    'rates': rates,
+                    'histograms': {name: hist.snapshot() for name, hist in self.histograms.items()}}
+
+class Reporter(threading.Thread):
+    """Publish snapshots of a Registry on 127.0.0.1:`port` and/or into `path` every `interval` seconds."""
+    def __init__(self, registry: Registry, port: int = 0, path: str = '', interval: float = 1.0):
+        super().__init__(daemon=True)
+        self.registry = registry;   self.interval = interval;   self.path = path
+        self.server = socket.create_server(('127.0.0.1', port)) if port else None
+        self.stopped = threading.Event()
+
+    def run(self):
+        next_write = time.monotonic()
+        while not self.stopped.is_set():
+            if self.path and time.monotonic() >= next_write:
+                self.write();   next_write += self.interval
+            timeout = max(0, next_write - time.monotonic()) if self.path else self.interval
+            if self.server is None:
+                self.stopped.wait(timeout);     continue
+            if select.select([self.server], [], [], timeout)[0]:
+                client, _ = self.server.accept()
+                with client:
+                    client.settimeout(1.0)
+                    try:
+                        client.sendall(json.dumps(self.registry.snapshot()).encode() + b'\n')
+                    except OSError:
+                        pass
+
+    def write(self):
+        """Replace the snapshot file atomically, readers never see half a snapshot."""
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(self.registry.snapshot(), file, indent=1)
+        os.replace(self.path + '.tmp', self.path)
+
+    def stop(self):
+        """Stop and leave the final snapshot in the file."""
+        self.stopped.set();     self.join()
+        if self.path: self.write()
+        if self.server: self.server.close()
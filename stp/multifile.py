@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Multi-file sessions, negotiated with OPT_FILES in the SYN.
+
+The sender sends several files over one connection as one byte stream:
+every file is a FILE header (its size and the length of its name), the
+name (UTF-8, no directories) and then its bytes; the size marks where the
+file ends. The stream is what gets compressed, checksummed and digested,
+like a single file's bytes otherwise.
+"""
+
+import os
+import struct
+from bisect import bisect_right
+
+FILE = struct.Struct('!QH')     # file size, name length
+
+def valid_name(name: str) -> bool:
+    """A plain file name: nothing that could leave the output directory."""
+    return bool(name) and name not in ('.', '..') and os.path.basename(name) == name and '\\' not in name and '\0' not in name
+
+class FileStream:
+    """`files` ([(name, path, size)]) framed into one stream; stream[a:b] is a view unless it spans several parts.
+
+    A file is only opened when the stream reaches it: `load(path)` returns
+    its bytes as a buffer, a mapping or a copy. Once a slice reaches the end
+    of a file the stream lets go of its buffer, so a mapping and its
+    descriptor last until the last segment viewing it is released. The
+    stream is read front to back, a directory of thousands of files never
+    holds more than a window's worth of them open.
+    """
+    def __init__(self, files: list, load):
+        self.load = load
+        self.parts = [];    self.starts = [];   self.ends = []  # buffers (None: not loaded) and their stream ranges
+        self.files = {}     # index of a file's part -> (path, size)
+        size = 0
+        for name, path, length in files:
+            name = name.encode();   head = FILE.pack(length, len(name)) + name
+            self.files[len(self.parts) + 1] = (path, length)
+            for part, n in ((memoryview(head), len(head)), (None, length)):
+                self.parts.append(part);    self.starts.append(size);   size += n;  self.ends.append(size)
+        self.size = size;   self.count = len(files)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, key: slice):
+        start, stop, _ = key.indices(self.size)
+        i = bisect_right(self.starts, start) - 1;  chunks = []
+        while start < stop:
+            part = self.parts[i]
+            if part is None: part = self.parts[i] = self.open(i)
+            offset = start - self.starts[i]
+            chunk = part[offset:offset + stop - start]
+            chunks.append(chunk);   start += len(chunk)
+            if start == self.ends[i] and i in self.files: self.parts[i] = None  # read to its end: the segments keep it alive
+            i += 1
+        if len(chunks) == 1: return chunks[0]
+        return memoryview(b''.join(chunks))     # small files and headers: copied into one segment
+
+    def extents(self) -> list:
+        """(stream offset, path, 0, size) of every file, in stream order."""
+        return [(self.starts[i], path, 0, size) for i, (path, size) in self.files.items()]
+
+    def open(self, i: int) -> memoryview:
+        path, size = self.files[i]
+        data = memoryview(self.load(path))
+        if len(data) < size: raise OSError(f"{path} shrank from {size} to {len(data)} bytes while it was sent")
+        return data[:size]
+
+class Demuxer:
+    """Split a FileStream back into files: feed() takes the in-order stream bytes.
+
+    `open(name)` returns the writer of a file (append() and close(), like
+    the receiver's OutputFile); `done(name, size)` is called when one is
+    complete.
+    """
+    def __init__(self, open, done=lambda name, size: None):
+        self.open = open;   self.done = done
+        self.head = bytearray();    self.name_len = None    # header bytes so far, name length once parsed
+        self.file = None;   self.name = '';     self.size = 0;  self.left = 0   # file being written
+        self.files = 0
+
+    def feed(self, data):
+        data = memoryview(data)
+        while data:
+            if self.file is not None:
+                chunk = data[:self.left];   data = data[len(chunk):]
+                self.file.append(chunk);    self.left -= len(chunk)
+            elif self.name_len is None:     # header
+                need = FILE.size - len(self.head)
+                self.head += data[:need];   data = data[need:]
+                if len(self.head) < FILE.size: return
+                self.size, self.name_len = FILE.unpack(self.head);  self.head.clear()
+                continue
+            else:   # name
+                need = self.name_len - len(self.head)
+                self.head += data[:need];   data = data[need:]
+                if len(self.head) < self.name_len: return
+                self.name = self.head.decode('utf-8', 'replace');   self.head.clear();  self.name_len = None
+                if not valid_name(self.name): self.name = f"unnamed_{self.files}"   # never write outside the directory
+                self.file = self.open(self.name);   self.left = self.size
+            if self.file is not None and not self.left:
+                self.file.close();  self.file = None;   self.files += 1
+                self.done(self.name, self.size)
+
+    def close(self) -> bool:
+        """End of the stream; False if it stopped inside a file."""
+        complete = self.file is None and self.name_len is None and not self.head
+        if self.file is not None: self.file.close();    self.file = None
+        return complete
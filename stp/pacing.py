@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Pacing: a token bucket that spreads a sender's segments out in time.
+
+Without it a window that opens is filled back to back, which on a real
+path lands as one burst in the bottleneck queue. The bucket fills at the
+rate rate() returns and holds at most QUANTUM seconds of it, so sends go
+out in small bursts with sleeps between them. A sleep is at least
+MIN_SLEEP, well above the timer resolution: at high rates the sender
+wakes up every MIN_SLEEP and sends what it earned in the meantime,
+instead of sleeping once per segment.
+"""
+
+import math
+import time
+
+QUANTUM = 0.005         # seconds of sending the bucket holds
+MIN_SLEEP = 0.001       # shortest pause before a segment
+SS_GAIN = 2.0;  CA_GAIN = 1.2   # pacing rate over cwnd/SRTT in slow start and after it (as Linux)
+
+def cwnd_rate(cc, srtt: float, limit: int) -> float:
+    """Pacing rate of a window: min(cwnd, limit) / SRTT, raised by a gain so pacing never holds cwnd back; 0 without an SRTT."""
+    if not srtt: return 0.0
+    gain = SS_GAIN if cc.cwnd < cc.ssthresh else CA_GAIN
+    return gain * min(cc.cwnd, limit) / srtt
+
+class Pacer:
+    """Token bucket; `rate()` returns the bytes/s to pace at now, 0 for no pacing."""
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = math.inf;     self.stamp = time.monotonic()   # the first burst goes out at once
+
+    def delay(self, size: int) -> float:
+        """Seconds to wait before `size` bytes may go; 0 means send now, the bytes are taken from the bucket."""
+        rate = self.rate();     now = time.monotonic()
+        if not rate:
+            self.stamp = now;   return 0.0
+        self.tokens = min(max(size, rate * QUANTUM), self.tokens + (now - self.stamp) * rate)
+        self.stamp = now
+        if self.tokens >= size:
+            self.tokens -= size;    return 0.0
+        return max((size - self.tokens) / rate, MIN_SLEEP)
+
+    def charge(self, size: int):
+        """`size` bytes went out unpaced (a retransmission), the next sends make up for them."""
+        self.tokens -= size
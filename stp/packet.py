@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""STP wire format shared by both programs.
+
+Every segment starts with a header of a 2-byte type and a seqno, 2 bytes
+wide unless 32-bit sequence numbers were negotiated. The SYN and the ACK
+answering it always use the 2-byte form and carry TCP-style options (kind,
+length, value) as payload; any other ACK may carry SACK blocks, after the
+receiver's free window if OPT_RWND is negotiated. Once
+OPT_CHECKSUM is negotiated, every later header ends in a CRC32 of the
+header and the payload.
+"""
+
+import socket
+import struct
+import sys
+import zlib
+from typing import NamedTuple
+
+from .seqnum import SeqSpace, SEQ16, SEQ32
+
+DATA = 0;   ACK = 1;    SYN = 2;    FIN = 3
+HDR = 2 + SEQ16.size    # Legacy header, always used by SYN and its ACK
+CRC = 4                 # Checksum field after the seqno, see OPT_CHECKSUM
+MAX_HDR = 2 + SEQ32.size + CRC
+UDP_MAX = 65507         # Largest UDP payload over IPv4
+MAX_MSS = UDP_MAX - MAX_HDR
+DEFAULT_MSS = 1000      # MSS of a peer that does not send the MSS option
+
+OPT_MSS = 2             # value: 2-byte MSS the sender of the option accepts
+OPT_SEQ32 = 3           # value: 4-byte ISN in the SYN, empty in the ACK accepting it
+OPT_WINDOW = 4          # value: 4-byte receiver window, in the SYN ACK
+OPT_STRIPE = 5          # value: Stripe of a striped transfer in the SYN, empty in the ACK accepting it
+OPT_COMPRESS = 6        # value: compression method asked for in the SYN, the one accepted in its ACK (stp.compress)
+OPT_RESUME = 7          # value: 16-byte file ID in the SYN, 8-byte offset to resume at in its ACK (stp.resume)
+OPT_CHECKSUM = 8        # empty: checksummed headers asked for in the SYN, accepted in its ACK; the FIN then carries DIGEST
+OPT_FILES = 9           # empty: a multi-file session (stp.multifile) asked for in the SYN, accepted in its ACK
+OPT_RWND = 10           # empty: window updates asked for in the SYN, accepted in its ACK; the data ACKs then start with a 4-byte free window
+RWND = 4                # bytes of the free window in front of a data ACK's SACK blocks, with OPT_RWND
+DIGEST_SIZE = 16        # bytes of the FIN's BLAKE2b digest of the file data the connection carried
+
+class Stripe(NamedTuple):
+    """Bytes [offset, offset + length) of a `total`-byte file, carried by flow `index` of `count`."""
+    session: int;   index: int;     count: int
+    offset: int;    length: int;    total: int
+
+STRIPE = struct.Struct('!IHHQQQ')
+
+def header_len(space: SeqSpace, checked: bool = False) -> int:
+    return 2 + space.size + (CRC if checked else 0)
+
+def make_header(space: SeqSpace, type: int, seqno: int, payload=None) -> bytes:
+    """Header of a segment; given its payload, the header ends in their CRC32 (checksummed headers)."""
+    hdr = type.to_bytes(2, 'big') + space.pack(seqno)
+    if payload is None: return hdr
+    return hdr + zlib.crc32(payload, zlib.crc32(hdr)).to_bytes(CRC, 'big')
+
+def parse_packet(buf, space: SeqSpace = SEQ16, checked: bool = False):
+    """Split a datagram into type, seqno and payload."""
+    return int.from_bytes(buf[:2], 'big'), space.unpack(buf, 2), buf[header_len(space, checked):]
+
+def intact(buf, space: SeqSpace) -> bool:
+    """Whether the CRC32 of a checksummed datagram matches, computed over views of it without copying."""
+    buf = memoryview(buf);  size = header_len(space)
+    if len(buf) < size + CRC: return False
+    return zlib.crc32(buf[size + CRC:], zlib.crc32(buf[:size])) == int.from_bytes(buf[size:size + CRC], 'big')
+
+def pack_sack(space: SeqSpace, blocks) -> bytes:
+    return b''.join(space.pack(left) + space.pack(right) for left, right in blocks)
+
+def unpack_sack(space: SeqSpace, buf) -> list:
+    """SACK blocks of an ACK payload as [(left, right)], right exclusive."""
+    step = 2 * space.size
+    return [(space.unpack(buf, i), space.unpack(buf, i + space.size)) for i in range(0, len(buf) - step + 1, step)]
+
+def pack_options(options: dict) -> bytes:
+    return b''.join(bytes([kind, len(value) + 2]) + value for kind, value in options.items())
+
+def unpack_options(buf) -> dict:
+    """Parse an option list into {kind: value}; stops at the first malformed entry."""
+    options = {};   i = 0
+    while i + 2 <= len(buf):
+        kind, length = buf[i], buf[i + 1]
+        if length < 2 or i + length > len(buf): break
+        options[kind] = bytes(buf[i + 2:i + length]);  i += length
+    return options
+
+def pack_stripe(stripe: Stripe) -> bytes:
+    return STRIPE.pack(*stripe)
+
+def unpack_stripe(buf):
+    """Stripe of an OPT_STRIPE value, None if it is malformed."""
+    return Stripe(*STRIPE.unpack(buf)) if len(buf) == STRIPE.size else None
+
+def path_mss(sock: socket.socket) -> int:
+    """Largest MSS that fits the path MTU of a connected socket.
+
+    Only Linux reports the path MTU (IP_MTU, not exported by the socket
+    module); elsewhere DEFAULT_MSS is returned.
+    """
+    if not sys.platform.startswith('linux'): return DEFAULT_MSS
+    try:
+        mtu = sock.getsockopt(socket.IPPROTO_IP, 14)    # IP_MTU
+    except OSError:
+        return DEFAULT_MSS
+    return max(DEFAULT_MSS, min(MAX_MSS, mtu - 28 - MAX_HDR))     # 20 bytes IPv4 + 8 bytes UDP
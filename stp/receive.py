@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""The receiving end of STP, shared by receiver/receiver.py and stp.connection.
+
+A ReceiveWindow keeps the in-order point, next_seq, and a ReorderBuffer
+of the bytes held past it. on_data() takes the payload of one DATA
+segment: a segment that straddles next_seq is cut to its new tail, bytes
+in order go to the owner's deliver() followed by the held bytes they
+reach, bytes past a hole are held, and anything before next_seq or
+beyond the window is refused. ack_payload() builds what a data ACK
+carries after its header. The owner decides how far past next_seq data
+may be held, when to ACK and which window to advertise.
+"""
+
+from .packet import RWND, pack_sack
+from .reorder import ReorderBuffer
+
+MAX_SACK = 4            # SACK blocks carried by one ACK
+
+class ReceiveWindow:
+    """In-order point and reorder ring of one receiving end.
+
+    `deliver(data)` takes the in-order bytes; ring bytes come as memoryviews
+    that are only valid until the next segment is held.
+    """
+    def __init__(self, seq, next_seq: int, max_win: int, deliver):
+        self.seq = seq;     self.next_seq = next_seq;   self.max_win = max_win
+        self.deliver = deliver
+        self.reorder = ReorderBuffer(max_win)   # out-of-order bytes past next_seq
+
+    def on_data(self, seqno: int, data, space: int = None) -> int:
+        """Take a DATA payload; returns the bytes it added, 0 for a duplicate and -1 beyond the window.
+
+        `space` is how far past next_seq bytes may be taken, max_win by default.
+        """
+        seq = self.seq;     reorder = self.reorder
+        offset = seq.diff(seqno, self.next_seq);    behind = seq.diff(self.next_seq, seqno)
+        if 0 < behind < len(data):  # overlaps the in-order point, only its tail is new
+            data = memoryview(data)[behind:];   offset = 0
+        if offset >= seq.half or not data: return 0     # entirely before next_seq
+        if offset + len(data) > (self.max_win if space is None else space): return -1
+        if offset: return reorder.add(offset, data)     # out of order: copied into the ring
+        new = moved = len(data);    self.deliver(data)
+        for chunk in reorder.advance(new):  # held bytes that follow are in order now
+            self.deliver(chunk);    moved += len(chunk)
+        self.next_seq = seq.add(self.next_seq, moved)
+        return new
+
+    def ack_payload(self, window: int = None) -> bytes:
+        """What a data ACK carries: the free `window` if OPT_RWND is negotiated (else None), then up to MAX_SACK SACK blocks."""
+        seq = self.seq;     next_seq = self.next_seq
+        sack = pack_sack(seq, [(seq.add(next_seq, start), seq.add(next_seq, end)) for start, end in self.reorder.blocks(MAX_SACK)])
+        return sack if window is None else window.to_bytes(RWND, 'big') + sack
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Reorder buffer of a receive window, shared by the receiver and stp.connection.
+
+Out-of-order bytes are copied into one preallocated ring (a bytearray of
+the window size, indexed by stream offset modulo its length) and the
+ranges held are kept as a sorted set of disjoint intervals. Adjacent and
+overlapping ranges merge on insert, so a window full of segments costs a
+handful of intervals instead of one bytes object and dict entry each, the
+number of bytes a segment adds tells duplicates and partial overlaps
+apart, and the intervals are the SACK blocks.
+
+Offsets passed in and out are relative to the in-order point: offset 0 is
+the next byte the receiver expects.
+"""
+
+from bisect import bisect_left, bisect_right
+
+class ReorderBuffer:
+    def __init__(self, capacity: int):
+        self.capacity = capacity;   self.ring = None    # allocated by the first out-of-order segment
+        self.base = 0           # stream offset of the in-order point
+        self.starts = [];   self.ends = [];     self.counts = []    # intervals [start, end) and their segments
+        self.buffered = 0;  self.segments = 0
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def add(self, offset: int, data) -> int:
+        """Hold `data` at `offset`; returns how many of its bytes were not held yet (0 = duplicate).
+
+        The segment must lie inside the window: offset + len(data) <= capacity.
+        """
+        start = self.base + offset;     end = start + len(data)
+        i = bisect_left(self.ends, start);  j = bisect_right(self.starts, end)  # [i, j) overlap or touch
+        held = sum(max(0, min(e, end) - max(s, start)) for s, e in zip(self.starts[i:j], self.ends[i:j]))
+        new = len(data) - held
+        if not new: return 0
+        if self.ring is None: self.ring = bytearray(self.capacity)
+        pos = start % self.capacity;    first = min(len(data), self.capacity - pos)
+        self.ring[pos:pos + first] = data[:first]
+        if first < len(data): self.ring[:len(data) - first] = data[first:]   # wrapped around
+        if i < j: start = min(start, self.starts[i]);   end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start];     self.ends[i:j] = [end]
+        self.counts[i:j] = [sum(self.counts[i:j]) + 1]
+        self.buffered += new;   self.segments += 1
+        return new
+
+    def advance(self, size: int) -> list:
+        """The caller consumed `size` in-order bytes; returns the held bytes that now follow them.
+
+        The result is up to two memoryviews into the ring (two if the range
+        wraps), valid until the next add().
+        """
+        self.base += size
+        while self.starts and self.starts[0] <= self.base:
+            start, end, count = self.starts.pop(0), self.ends.pop(0), self.counts.pop(0)
+            self.buffered -= end - start;   self.segments -= count
+            if end <= self.base: continue   # overtaken by the in-order data
+            chunks = self.slice(self.base, end);    self.base = end
+            return chunks
+        return []
+
+    def slice(self, start: int, end: int) -> list:
+        view = memoryview(self.ring);   pos = start % self.capacity;    size = end - start
+        if pos + size <= self.capacity: return [view[pos:pos + size]]
+        return [view[pos:], view[:pos + size - self.capacity]]
+
+    def blocks(self, limit: int) -> list:
+        """The first `limit` held ranges as [(start, end)] offsets, end exclusive."""
+        return [(s - self.base, e - self.base) for s, e in zip(self.starts[:limit], self.ends[:limit])]
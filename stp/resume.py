@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Resumable transfers, negotiated with OPT_RESUME in the SYN.
+
+A sender that wants to resume puts the ID of its file in the SYN. The
+receiver keeps a checkpoint next to the output file, `<output>.resume`:
+the file ID on the first line, then one `offset crc32` line for every
+BLOCK bytes written in order, appended as they reach the file. When a SYN
+names the same file again the receiver checks the listed blocks against
+what is on disk, answers with the end of the last good one and the sender
+only streams the rest. A finished transfer removes the checkpoint.
+
+Lines are written after the data they cover, so a crashed process never
+leaves a checkpoint claiming bytes it did not write; without fsync a
+power loss still can, which the check on resume catches.
+"""
+
+import hashlib
+import os
+import zlib
+
+BLOCK = 1 << 20     # bytes covered by one checksum
+
+def file_id(path: str) -> bytes:
+    """16-byte ID of a file from its name, size and modification time: an edited file starts over."""
+    st = os.stat(path)
+    return hashlib.blake2b(f"{os.path.basename(path)}\0{st.st_size}\0{st.st_mtime_ns}".encode(), digest_size=16).digest()
+
+class Checkpoint:
+    """Checkpoint of one output file; `offset` is where the transfer (re)starts."""
+    def __init__(self, filename: str, id: bytes):
+        self.path = filename + '.resume';   self.offset = 0
+        lines = []
+        try:
+            with open(self.path) as file: lines = file.read().splitlines()
+        except OSError:
+            pass
+        good = []
+        if lines and lines[0] == id.hex():  # same file: keep the blocks that are still intact on disk
+            try:
+                with open(filename, 'rb') as out:
+                    for line in lines[1:]:
+                        end, crc = line.split()
+                        if int(end) != self.offset + BLOCK or zlib.crc32(out.read(BLOCK)) != int(crc, 16): break
+                        good.append(line);  self.offset += BLOCK
+            except (OSError, ValueError):
+                pass
+        with open(self.path + '.tmp', 'w') as file:
+            file.write('\n'.join([id.hex(), *good]) + '\n')
+        os.replace(self.path + '.tmp', self.path)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self.pos = self.offset;     self.crc = 0    # in-order bytes written so far, CRC of the current block
+
+    def written(self, data):
+        """`data` reached the file in order, right after the bytes before it."""
+        data = memoryview(data)
+        while data:
+            chunk = data[:BLOCK - self.pos % BLOCK];    data = data[len(chunk):]
+            self.crc = zlib.crc32(chunk, self.crc);     self.pos += len(chunk)
+            if not self.pos % BLOCK:
+                os.write(self.fd, f"{self.pos} {self.crc:08x}\n".encode());   self.crc = 0
+
+    def close(self):
+        if self.fd is not None: os.close(self.fd);  self.fd = None
+
+    def remove(self):
+        """The transfer is complete, nothing left to resume."""
+        self.close();   os.remove(self.path)
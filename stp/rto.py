@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Retransmission timeout estimation shared by the sender and stp.connection."""
+
+class RtoEstimator:
+    """Retransmission timeout from smoothed RTT samples (Jacobson/Karels, RFC 6298).
+
+    `initial` (the CLI rto) is only used until the first sample arrives. Each
+    backoff() doubles the timeout until the next valid sample resets it. The
+    estimate never drops below `min_rto` (200ms as Linux by default): a
+    lower floor turns every scheduling hiccup on a short path into a
+    spurious timeout, which also collapses cwnd.
+    """
+    ALPHA = 1/8;    BETA = 1/4;     K = 4
+    MIN_RTO = 0.2;  MAX_RTO = 60.0  # seconds
+
+    def __init__(self, initial: float, granularity: float, min_rto: float = MIN_RTO):
+        self.srtt = None;   self.rttvar = None
+        self.granularity = granularity;     self.min_rto = min_rto
+        self.base = initial;    self.backoffs = 0
+
+    @property
+    def rto(self) -> float:
+        return min(self.MAX_RTO, self.base * 2**self.backoffs)
+
+    def sample(self, r: float):
+        if self.srtt is None:
+            self.srtt = r;  self.rttvar = r / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - r)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * r
+        self.base = min(self.MAX_RTO, max(self.min_rto, self.srtt + max(self.granularity, self.K * self.rttvar)))
+        self.backoffs = 0
+
+    def backoff(self):
+        if self.rto < self.MAX_RTO: self.backoffs += 1
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Serial number arithmetic (RFC 1982) shared by both programs.
+
+A connection uses the legacy 16-bit sequence space unless both sides agreed
+on 32-bit sequence numbers in the SYN exchange (OPT_SEQ32 in packet.py).
+Comparisons are only meaningful between numbers less than half the space
+apart, which is why a window must stay below `half`.
+"""
+
+class SeqSpace:
+    def __init__(self, bits: int):
+        self.bits = bits;   self.size = bits // 8   # bytes on the wire
+        self.mod = 1 << bits;   self.half = self.mod >> 1
+
+    def add(self, a: int, n: int) -> int:
+        return (a + n) % self.mod
+
+    def diff(self, a: int, b: int) -> int:
+        """Forward distance from b to a."""
+        return (a - b) % self.mod
+
+    def lt(self, a: int, b: int) -> bool:
+        return a != b and self.diff(b, a) < self.half
+
+    def le(self, a: int, b: int) -> bool:
+        return a == b or self.lt(a, b)
+
+    def pack(self, seqno: int) -> bytes:
+        return seqno.to_bytes(self.size, 'big')
+
+    def unpack(self, buf, offset: int = 0) -> int:
+        return int.from_bytes(buf[offset:offset + self.size], 'big')
+
+SEQ16 = SeqSpace(16)
+SEQ32 = SeqSpace(32)